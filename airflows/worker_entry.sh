@@ -3,4 +3,5 @@
 set -Eeuxo pipefail
 
 sleep 30
-airflow celery worker
\ No newline at end of file
+# exec, so the SIGTERM of ecs reaches celery (warm shutdown)
+exec airflow celery worker
\ No newline at end of file
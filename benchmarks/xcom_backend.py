@@ -0,0 +1,244 @@
+"""End to end benchmark of S3XComBackend.serialize_value / deserialize_value
+against a local s3 stand in, a moto server (in the parent process, so it
+doesn't count towards the memory & disk of the cases) by default or any s3
+compatible server (i.e. MinIO) when the AWSS3LogStorage connection is given
+through the environment:
+
+    AIRFLOW_CONN_AWSS3LOGSTORAGE='aws://key:secret@/?host=http://minio:9000'
+
+    python benchmarks/xcom_backend.py --repeat 3 --output results.json
+    python benchmarks/xcom_backend.py --baseline results.json --tolerance 0.25
+
+Every case runs in its own process so peak RSS and the temporary files it
+leaves behind belong to that case alone. Reported per case: latency of the
+push, of a cold pull (empty caches) and of a warm pull, throughput of
+push/pull over the payload size, peak RSS and peak temp-disk usage. With
+--baseline the run fails (exit code 1) when a latency regresses more than
+--tolerance, so it can gate a deploy.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from multiprocessing import get_context
+from pathlib import Path
+from resource import RUSAGE_SELF, getrusage
+from types import SimpleNamespace
+from typing import Callable, Dict
+
+ROOT = Path(__file__).resolve().parent.parent
+BUCKET_NAME = "benchmark-xcom"
+MB = 1024 * 1024
+
+
+def small_dict():
+    return {"rows": 1000, "status": "ok", "tags": ["a", "b"], "ratio": 0.5}
+
+
+def big_dict():
+    return {f"key_{i}": {"id": i, "name": f"name {i}"} for i in range(50_000)}
+
+
+def _frame(n_rows: int, n_columns: int):
+    import numpy
+    import pandas
+
+    generator = numpy.random.default_rng(0)
+    frame = pandas.DataFrame(
+        generator.random((n_rows, n_columns)),
+        columns=[f"c{i}" for i in range(n_columns)],
+    )
+    frame["label"] = (frame["c0"] * 100).astype(int).astype(str)
+    return frame
+
+
+# in memory sizes are approximate, 8 bytes per float cell
+CASES: Dict[str, Callable] = {
+    "small_dict": small_dict,
+    "big_dict": big_dict,
+    "df_10mb_tall": lambda: _frame(10 * MB // 8 // 8, 8),
+    "df_10mb_wide": lambda: _frame(10 * MB // 8 // 1000, 1000),
+    "df_100mb_tall": lambda: _frame(100 * MB // 8 // 8, 8),
+    "df_1gb_tall": lambda: _frame(1024 * MB // 8 // 8, 8),
+}
+DEFAULT_CASES = ["small_dict", "big_dict", "df_10mb_tall", "df_10mb_wide"]
+
+
+def _payload_size(value) -> int:
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(deep=True).sum())
+    return len(json.dumps(value))
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class _DiskWatcher(threading.Thread):
+    """polls the temporary directory, spooled files are anonymous (already
+    unlinked) on linux, so their usage shows in statvfs, not in the tree"""
+
+    def __init__(self, path: str):
+        super().__init__(daemon=True)
+        self.path = path
+        self.peak = 0
+        self._done = threading.Event()
+        self._baseline = self._used()
+
+    def _used(self) -> int:
+        stat = os.statvfs(self.path)
+        used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+        return max(used, _directory_size(self.path))
+
+    def run(self):
+        while not self._done.wait(0.01):
+            self.peak = max(self.peak, self._used() - self._baseline)
+
+    def stop(self) -> int:
+        self._done.set()
+        self.join()
+        return self.peak
+
+
+def _s3_stand_in():
+    """moto server unless a real s3 compatible endpoint was configured"""
+    if os.getenv("AIRFLOW_CONN_AWSS3LOGSTORAGE"):
+        return None
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ["AIRFLOW_CONN_AWSS3LOGSTORAGE"] = (
+        f"aws://benchmark:benchmark@/?host=http%3A%2F%2F{host}%3A{port}"
+        "&region_name=us-east-1"
+    )
+    return server
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run_case(name: str, repeat: int) -> dict:
+    """runs inside a fresh process"""
+    temporary_directory = tempfile.mkdtemp(prefix="xcom-benchmark-")
+    tempfile.tempdir = temporary_directory  # spooled & spill files land here
+    os.environ["XCOM_S3_BUCKET"] = BUCKET_NAME
+    sys.path.insert(0, str(ROOT))
+
+    from s3_xcom_backend import S3XComBackend, s3_client
+
+    client = s3_client()
+    try:
+        client.create_bucket(Bucket=BUCKET_NAME)
+    except client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    value = CASES[name]()
+    size = _payload_size(value)
+    watcher = _DiskWatcher(temporary_directory)
+    watcher.start()
+    push, cold_pull, warm_pull = [], [], []
+    for _ in range(repeat):
+        stored, elapsed = _timed(S3XComBackend.serialize_value, value)
+        push.append(elapsed)
+        row = SimpleNamespace(value=stored)  # what airflow hands over
+        S3XComBackend.CACHE.clear()
+        _, elapsed = _timed(S3XComBackend.deserialize_value, row)
+        cold_pull.append(elapsed)
+        _, elapsed = _timed(S3XComBackend.deserialize_value, row)
+        warm_pull.append(elapsed)
+    peak_disk = watcher.stop()
+
+    push_time, cold_time = min(push), min(cold_pull)
+    return {
+        "case": name,
+        "payload_mb": round(size / MB, 2),
+        "push_s": round(push_time, 5),
+        "cold_pull_s": round(cold_time, 5),
+        "warm_pull_s": round(min(warm_pull), 5),
+        "push_mb_s": round(size / MB / push_time, 1),
+        "pull_mb_s": round(size / MB / cold_time, 1),
+        # kilobytes on linux
+        "peak_rss_mb": round(getrusage(RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_tmp_mb": round(peak_disk / MB, 1),
+    }
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    rows = json.loads(Path(baseline_path).read_text())
+    baseline = {row["case"]: row for row in rows}
+    regressions = []
+    for row in results:
+        previous = baseline.get(row["case"])
+        if not previous:
+            continue
+        for metric in ("push_s", "cold_pull_s", "warm_pull_s"):
+            if row[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{row['case']} {metric}: "
+                    f"{previous[metric]}s -> {row[metric]}s"
+                )
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="S3XComBackend benchmark")
+    parser.add_argument(
+        "--cases",
+        default=",".join(DEFAULT_CASES),
+        help=f"comma separated, available: {', '.join(CASES)}",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write results as json")
+    parser.add_argument("--baseline", help="json written by a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    arguments = parser.parse_args()
+
+    columns = (
+        "case",
+        "payload_mb",
+        "push_s",
+        "cold_pull_s",
+        "warm_pull_s",
+        "push_mb_s",
+        "pull_mb_s",
+        "peak_rss_mb",
+        "peak_tmp_mb",
+    )
+    print("".join(f"{c:>14}" for c in columns))
+    results = []
+    server = _s3_stand_in()  # inherited by the cases through the environment
+    context = get_context("spawn")  # nothing inherited between cases
+    for name in arguments.cases.split(","):
+        with context.Pool(1) as pool:
+            row = pool.apply(run_case, (name, arguments.repeat))
+        results.append(row)
+        print("".join(f"{row[c]:>14}" for c in columns))
+    if server:
+        server.stop()
+
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(results, indent=2))
+    if arguments.baseline:
+        regressions = compare(results, arguments.baseline, arguments.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
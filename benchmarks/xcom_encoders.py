@@ -0,0 +1,115 @@
+"""Throughput of the encoders S3XComBackend uses for non DataFrame payloads
+(anything stored as a document: dicts, lists, numbers...) versus the
+`json.dumps(json.loads(str(value)))` round trip it used to do.
+
+    python benchmarks/xcom_encoders.py --rows 100000 --repeat 5
+
+MB/s are computed over the size of the stdlib json encoding of the payload
+so every row of the table is comparable, "failed" means the encoder can't
+handle that payload at all (the legacy path breaks on any python repr that
+is not valid json, i.e. dicts with single quotes or True/None).
+"""
+import io
+import json
+import sys
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from timeit import repeat
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from s3_xcom_backend import SERIALIZERS, ENCODERS  # noqa: E402
+
+
+def legacy_encode(value):
+    return json.dumps(json.loads(str(value))).encode()
+
+
+def payloads(rows: int) -> dict:
+    start = datetime(2022, 7, 1)
+    return {
+        "floats": [i * 0.5 for i in range(rows)],
+        "records": [
+            {
+                "id": i,
+                "name": f"user {i}",
+                "score": i / 3,
+                "active": i % 2 == 0,
+            }
+            for i in range(rows)
+        ],
+        "typed records": [
+            {
+                "id": i,
+                "created": start + timedelta(seconds=i),
+                "amount": Decimal(i) / 100,
+                "raw": i.to_bytes(4, "little"),
+            }
+            for i in range(rows)
+        ],
+    }
+
+
+def codecs() -> dict:
+    result = {"legacy str()/json.loads": (legacy_encode, SERIALIZERS["json"])}
+    for name, encode in ENCODERS.items():
+        for compression in ("", "+gzip", "+zstd"):
+            serializer = SERIALIZERS[name + compression]
+            result[name + compression] = (encode, serializer)
+    return result
+
+
+def measure(encode, serializer, value, repeat_times: int):
+    def dump():
+        buffer = io.BytesIO()
+        serializer.dump(encode(value), buffer)
+        return buffer
+
+    buffer = dump()
+    size = buffer.tell()
+
+    def load():
+        buffer.seek(0)
+        return serializer.load(buffer)
+
+    encode_time = min(repeat(dump, number=1, repeat=repeat_times))
+    decode_time = min(repeat(load, number=1, repeat=repeat_times))
+    return size, encode_time, decode_time
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+
+    header = f"{'payload':<14}{'codec':<26}{'size MB':>9}"
+    header += f"{'enc MB/s':>10}{'dec MB/s':>10}"
+    print(header)
+    print("-" * len(header))
+    for payload_name, value in payloads(arguments.rows).items():
+        reference_mb = len(json.dumps(value, default=str)) / 1024 / 1024
+        for codec_name, (encode, serializer) in codecs().items():
+            try:
+                size, encode_time, decode_time = measure(
+                    encode, serializer, value, arguments.repeat
+                )
+            except (TypeError, ValueError, ImportError) as error:
+                print(
+                    f"{payload_name:<14}{codec_name:<26}  failed: {error}"[
+                        :100
+                    ]
+                )
+                continue
+            print(
+                f"{payload_name:<14}{codec_name:<26}"
+                f"{size / 1024 / 1024:>9.2f}"
+                f"{reference_mb / encode_time:>10.1f}"
+                f"{reference_mb / decode_time:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""How much does it cost to parse each dag file? run it where the dags run
+(i.e. inside the scheduler container, from /opt/airflow)
+
+    python dag_parse_profiler.py
+    python dag_parse_profiler.py --budgets dag_parse_budgets.json \
+        --output parse.json
+
+Every file under DAGS_FOLDER (.airflowignore & safe mode are honored, as the
+scheduler does) is imported in its own process, after importing
+airflow.models like the DagFileProcessor already did before forking, so
+the numbers are what a parse adds on top of it. Reported per file: wall
+time, import time of the top level modules it pulls in (-X importtime),
+peak RSS growth and metadata db queries.
+
+Budgets are a json object, keys are glob patterns relative to DAGS_FOLDER
+(first match wins, "*" as fallback) and values the limits of a file, i.e.
+{"yokharian/*": {"seconds": 2, "rss_mb": 150, "queries": 0}}. The exit
+code is 1 when a file goes over its budget or fails to import.
+"""
+import json
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from fnmatch import fnmatch
+from hashlib import sha1
+from os import getenv
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# same resolution than dags/yokharian/shareds.py, it isn't imported so the
+# profiler runs without the dags folder in sys.path
+DAGS_FOLDER = Path(getenv("EFS_GIT_REPO_FULL_PATH", "/")).joinpath("dags")
+DEFAULT_BUDGETS = Path(__file__).resolve().parent / "dag_parse_budgets.json"
+MARKER = "--- dag import starts ---"
+METRICS = ("seconds", "rss_mb", "queries")
+
+
+def list_dag_files(dags_folder: Path) -> List[Path]:
+    try:
+        from airflow.utils.file import list_py_file_paths
+    except ImportError:  # not an airflow environment
+        return sorted(dags_folder.rglob("*.py"))
+    return sorted(Path(p) for p in list_py_file_paths(str(dags_folder)))
+
+
+def _run_one(path: str, dags_folder: str):
+    """runs in the child process, the report is printed as json"""
+    import importlib.util
+    import time
+    from resource import RUSAGE_SELF, getrusage
+
+    sys.path.insert(0, dags_folder)
+    import airflow.models  # noqa: F401 (already in the DagFileProcessor)
+    from airflow.models.dag import DAG
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    queries = []
+    event.listen(
+        Engine,
+        "before_cursor_execute",
+        lambda *args, **kwargs: queries.append(1),
+    )
+    rss_before = getrusage(RUSAGE_SELF).ru_maxrss
+    print(MARKER, file=sys.stderr, flush=True)
+
+    # airflow.models.dagbag names modules the same way
+    name = (
+        f"unusual_prefix_{sha1(path.encode()).hexdigest()}_{Path(path).stem}"
+    )
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    start = time.perf_counter()
+    error = None
+    try:
+        spec.loader.exec_module(module)
+    except BaseException as exception:  # SystemExit too, i.e. a dag.cli()
+        error = f"{type(exception).__name__}: {exception}"
+    seconds = time.perf_counter() - start
+    dags = [v for v in vars(module).values() if isinstance(v, DAG)]
+    print(
+        json.dumps(
+            {
+                "seconds": round(seconds, 3),
+                # kilobytes on linux
+                "rss_mb": round(
+                    (getrusage(RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1
+                ),
+                "queries": len(queries),
+                "dags": len(dags),
+                "error": error,
+            }
+        )
+    )
+
+
+def _top_level_imports(stderr: str, top: int) -> Dict[str, float]:
+    """cumulative ms per root package of the imports the dag file started,
+    i.e. {"pandas": 420.1, "loguru": 35.2}"""
+    _, _, lines = stderr.partition(MARKER)
+    milliseconds = defaultdict(float)
+    for line in lines.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("  "):  # nested, already in its parent
+            continue
+        milliseconds[name.strip().split(".")[0]] += int(cumulative) / 1000
+    ranking = sorted(milliseconds.items(), key=lambda x: x[1], reverse=True)
+    return {k: round(v, 1) for k, v in ranking[:top]}
+
+
+def profile(path: Path, dags_folder: Path, timeout: float, top: int) -> dict:
+    row = {"file": str(path.relative_to(dags_folder))}
+    try:
+        process = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                __file__,
+                "--run-one",
+                str(path),
+            ],
+            env={**os.environ, "DAGS_FOLDER": str(dags_folder)},
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return {**row, "error": f"timed out after {timeout}s"}
+    try:
+        report = json.loads(process.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        error = process.stderr.strip().splitlines()[-1:] or ["no output"]
+        return {**row, "error": error[0]}
+    return {
+        **row,
+        **report,
+        "imports_ms": _top_level_imports(process.stderr, top),
+    }
+
+
+def budget_for(file: str, budgets: dict) -> Optional[dict]:
+    for pattern, budget in budgets.items():
+        if fnmatch(file, pattern):
+            return budget
+    return None
+
+
+def over_budget(row: dict, budgets: dict) -> List[str]:
+    if row.get("error"):
+        return [f"{row['file']}: {row['error']}"]
+    budget = budget_for(row["file"], budgets) or {}
+    return [
+        f"{row['file']}: {metric} {row[metric]} > {budget[metric]}"
+        for metric in METRICS
+        if metric in budget and row[metric] > budget[metric]
+    ]
+
+
+def main():
+    parser = ArgumentParser(description="dag files parse time profiler")
+    parser.add_argument("--dags-folder", type=Path, default=DAGS_FOLDER)
+    parser.add_argument(
+        "--budgets",
+        type=Path,
+        default=DEFAULT_BUDGETS if DEFAULT_BUDGETS.exists() else None,
+        help=f"json file of limits, defaults to {DEFAULT_BUDGETS.name}",
+    )
+    parser.add_argument("--max-seconds", type=float, help="for every file")
+    parser.add_argument("--max-rss-mb", type=float, help="for every file")
+    parser.add_argument("--max-queries", type=int, help="for every file")
+    # same default as [core] dagbag_import_timeout in airflow.cfg
+    parser.add_argument("--timeout", type=float, default=15.0)
+    parser.add_argument("--top", type=int, default=5, help="modules shown")
+    parser.add_argument("--output", help="write results as json")
+    parser.add_argument("--run-one", help="internal, profiles one file")
+    arguments = parser.parse_args()
+
+    if arguments.run_one:
+        return _run_one(arguments.run_one, os.environ["DAGS_FOLDER"])
+
+    budgets = (
+        json.loads(arguments.budgets.read_text()) if arguments.budgets else {}
+    )
+    limits = {
+        "seconds": arguments.max_seconds,
+        "rss_mb": arguments.max_rss_mb,
+        "queries": arguments.max_queries,
+    }
+    limits = {k: v for k, v in limits.items() if v is not None}
+    if limits:  # command line limits apply on top of the budgets file
+        budgets = {k: {**v, **limits} for k, v in budgets.items()}
+        budgets.setdefault("*", limits)
+
+    dags_folder = arguments.dags_folder.resolve()
+    print(f"{'file':<60}{'seconds':>9}{'rss_mb':>8}{'queries':>9}{'dags':>6}")
+    results, failures = [], []
+    for path in list_dag_files(dags_folder):
+        row = profile(path, dags_folder, arguments.timeout, arguments.top)
+        results.append(row)
+        failures += over_budget(row, budgets)
+        if row.get("error"):
+            print(f"{row['file']:<60} ERROR {row['error']}")
+            continue
+        print(
+            f"{row['file']:<60}{row['seconds']:>9}{row['rss_mb']:>8}"
+            f"{row['queries']:>9}{row['dags']:>6}"
+        )
+        imports = ", ".join(f"{k} {v}ms" for k, v in row["imports_ms"].items())
+        print(f"    imports: {imports}")
+
+    if arguments.output:
+        Path(arguments.output).write_text(json.dumps(results, indent=2))
+    for failure in failures:
+        print(f"OVER BUDGET {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
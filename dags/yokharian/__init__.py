@@ -1,34 +1,35 @@
-import json
-import shutil
-from os import environ, getenv
+"""imported by every dag file at parse time, keep it cheap: no connections,
+no environment checks, those happen when a task runs (see
+prepare_task_environment, the pre_execute hook of shareds.default_args)
+and are measured by dag_parse_profiler.py"""
+from os import environ
 
 BOOL_MAP = {"True": True, "False": False}
 
-try:
-    from airflow.hooks.base import BaseHook
+
+def prepare_task_environment(context=None):
+    """runs right before every task, in the worker, raising fails the task.
+
+    it's a pre_execute hook, not an on_execute_callback: airflow only logs
+    the exceptions of the latter and runs the task anyway"""
+    import json
+    import shutil
+
+    if not shutil.which("virtualenv"):
+        raise ModuleNotFoundError(
+            "most dags listed here requires virtualenv library,"
+            " please install it."
+        )
+
+    from .connections import get_connection
 
     # required airflow connection, read
     # https://airflow.apache.org/docs/apache-airflow-providers-influxdb/1.1.0/connections/influxdb.html
-    INFLUX_CONN: str = str(
-        BaseHook.get_connection("InfluxDBConn").get_extra()
-    )
-    environ["INFLUX_TOKEN"] = json.loads(INFLUX_CONN).get("token", "")
+    influx_conn: str = str(get_connection("InfluxDBConn").get_extra())
+    environ["INFLUX_TOKEN"] = json.loads(influx_conn).get("token", "")
 
     # required to retrieve & STORAGE logs in s3, read
     # https://airflow.apache.org/docs/apache-airflow-providers-amazon/stable/connections/aws.html
     # https://airflow.apache.org/docs/apache-airflow-providers-amazon/stable/logging/s3-task-handler.html
     # without this there will be no log messages
-    BaseHook.get_connection("AWSS3LogStorage")
-
-except ImportError:
-    # disable for virtualenv operators, enable for all other dags, because
-    # of virtualenv operators may not have airflow pip library installed
-    # the priority is to ensure that the webServer & scheduler container's
-    # has these connections.
-    ...
-
-if not shutil.which("virtualenv"):
-    raise ModuleNotFoundError(
-        "most dags listed here requires virtualenv library,"
-        " please install it."
-    )
+    get_connection("AWSS3LogStorage")
@@ -0,0 +1,169 @@
+"""airflow connections cached for CONNECTION_TTL_SECONDS.
+
+dag files are parsed again every min_file_process_interval, each time in a
+freshly forked process, so a module level cache alone dies with the parse;
+connections are also kept in a file per connection, encrypted with the
+fernet key of the metadata db, which every process of this user shares.
+Without a fernet key (or when the directory may be read by someone else)
+they're only cached in memory. When the metadata db (or the secrets
+backend) fails or takes longer than CONNECTION_LOOKUP_TIMEOUT_SECONDS, the
+last known value is used instead, and it's not asked again until the TTL
+expires."""
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+from os import getenv
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Dict, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+CONNECTION_TTL_SECONDS = float(getenv("CONNECTION_TTL_SECONDS", 300))
+# only applies when there's a (stale) value to fall back to
+CONNECTION_LOOKUP_TIMEOUT_SECONDS = float(
+    getenv("CONNECTION_LOOKUP_TIMEOUT_SECONDS", 10)
+)
+CONNECTION_CACHE_DIR = Path(
+    getenv(
+        "CONNECTION_CACHE_DIR",
+        Path(tempfile.gettempdir(), f"airflow-connections-{os.getuid()}"),
+    )
+)
+# the fields a Connection is rebuilt from
+FIELDS = (
+    "conn_type",
+    "description",
+    "host",
+    "login",
+    "password",
+    "schema",
+    "port",
+    "extra",
+)
+
+_CACHE: Dict[str, Tuple[float, "Connection"]] = {}
+_LOCK = Lock()
+
+
+def _fernet():
+    """None when connections can't be stored encrypted"""
+    from airflow.models.crypto import get_fernet
+
+    fernet = get_fernet()
+    return fernet if fernet.is_encrypted else None
+
+
+def _private_dir() -> bool:
+    """the cache directory exists, is not a symlink, belongs to this user
+    and nobody else can read or write it (i.e. a directory created in
+    /tmp beforehand by another user is never trusted)"""
+    try:
+        CONNECTION_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        status = os.lstat(CONNECTION_CACHE_DIR)
+    except OSError as error:
+        log.warning("connection cache unavailable: %s", error)
+        return False
+    if (
+        not stat.S_ISDIR(status.st_mode)
+        or status.st_uid != os.getuid()
+        or status.st_mode & 0o077
+    ):
+        log.warning("not using %s, it isn't private", CONNECTION_CACHE_DIR)
+        return False
+    return True
+
+
+def _path(conn_id: str) -> Path:
+    return CONNECTION_CACHE_DIR.joinpath(f"{conn_id}.json")
+
+
+def _read(conn_id: str) -> Optional[Tuple[float, "Connection"]]:
+    from airflow.models.connection import Connection
+    from cryptography.fernet import InvalidToken
+
+    fernet = _fernet()
+    if fernet is None or not _private_dir():
+        return None
+    try:
+        cached = json.loads(fernet.decrypt(_path(conn_id).read_bytes()))
+    except (OSError, ValueError, InvalidToken):  # i.e. the key was rotated
+        return None
+    connection = Connection(conn_id=conn_id, **cached["fields"])
+    return cached["fetched_at"], connection
+
+
+def _write(conn_id: str, fetched_at: float, connection: "Connection"):
+    fernet = _fernet()
+    if fernet is None or not _private_dir():
+        return
+    fields = {name: getattr(connection, name) for name in FIELDS}
+    cached = json.dumps({"fetched_at": fetched_at, "fields": fields})
+    path = _path(conn_id)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW
+        descriptor = os.open(tmp_path, flags, 0o600)
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(fernet.encrypt(cached.encode()))
+        os.replace(tmp_path, path)
+    except OSError as error:
+        log.warning("could not cache connection %s: %s", conn_id, error)
+
+
+def _lookup(conn_id: str, timeout: Optional[float]):
+    """BaseHook.get_connection giving up after timeout seconds, the lookup
+    keeps going in the background (the db session can't be interrupted)"""
+    from airflow.hooks.base import BaseHook
+
+    if timeout is None:
+        return BaseHook.get_connection(conn_id)
+    result = {}
+
+    def lookup():
+        try:
+            result["connection"] = BaseHook.get_connection(conn_id)
+        except Exception as error:
+            result["error"] = error
+
+    thread = Thread(target=lookup, name=f"connection-{conn_id}", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise TimeoutError(f"no answer after {timeout}s")
+    if "error" in result:
+        raise result["error"]
+    return result["connection"]
+
+
+def get_connection(conn_id: str, ttl: float = CONNECTION_TTL_SECONDS):
+    """BaseHook.get_connection, at most once per ttl (seconds).
+
+    raises only if the connection was never resolved, otherwise a stale
+    value is returned when the lookup fails or is too slow"""
+    now = time.time()
+    with _LOCK:
+        cached = _CACHE.get(conn_id)
+        if not cached or now - cached[0] >= ttl:  # maybe another process
+            candidates = [c for c in (cached, _read(conn_id)) if c]
+            cached = max(candidates, key=lambda c: c[0], default=None)
+            if cached:
+                _CACHE[conn_id] = cached
+    if cached and now - cached[0] < ttl:
+        return cached[1]
+
+    timeout = CONNECTION_LOOKUP_TIMEOUT_SECONDS if cached else None
+    try:
+        connection = _lookup(conn_id, timeout)
+    except Exception as error:
+        if not cached:
+            raise
+        log.warning("using a stale %s connection: %r", conn_id, error)
+        connection = cached[1]  # retried once the ttl expires again
+    with _LOCK:
+        _CACHE[conn_id] = (now, connection)
+        _write(conn_id, now, connection)
+    return connection
@@ -19,15 +19,23 @@ from datetime import datetime, timedelta
 from airflow.models import Param
 from airflow.operators.email import EmailOperator
 from airflow import DAG
-from airflow.hooks.base import BaseHook
 
 try:  # local environment
+    from dags.yokharian.connections import get_connection
     from dags.yokharian.shareds import *
 except ImportError:  # airflow environment
     # noinspection PyUnresolvedReferences
+    from yokharian.connections import get_connection
     from yokharian.shareds import *
 
-EMAIL_CONN_ID = "awsEmailDefault"  # needed to load & run dag, read the __doc__
+EMAIL_CONN_ID = "awsEmailDefault"  # needed to run the dag, read the __doc__
+
+
+def prepare_email_environment(context=None):
+    """the connection is resolved when the task runs, not at parse time"""
+    prepare_task_environment(context)
+    get_connection(EMAIL_CONN_ID)
+
 
 with DAG(
     doc_md=__doc__,
@@ -40,6 +48,7 @@ with DAG(
         "email": ["sofia@escobedo.mx"],
         "owner": "sofia",
         "pool": None,
+        "pre_execute": prepare_email_environment,
     },
     start_date=datetime(2022, 5, 24),
     # https://airflow.apache.org/docs/apache-airflow/2.3.1/concepts/params.html
@@ -84,8 +93,9 @@ with DAG(
     render_template_as_native_obj=True,
     is_paused_upon_creation=False,
 ) as dag:
-    BaseHook.get_connection(EMAIL_CONN_ID)
-    EmailOperator.template_fields = "to,subject,html_content,files,cc,bcc".split(",")
+    EmailOperator.template_fields = (
+        "to,subject,html_content,files,cc,bcc".split(",")
+    )
     email_status = EmailOperator(
         task_id="send_email",
         conn_id=EMAIL_CONN_ID,
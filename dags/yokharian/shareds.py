@@ -1,3 +1,6 @@
+"""star-imported by every dag file, parsed by the scheduler every
+min_file_process_interval: only cheap imports here, loguru is imported
+by basic_loguru (or `shareds.logger`) when a task needs it"""
 import logging
 import os
 import sys
@@ -6,9 +9,7 @@ from datetime import timedelta
 from pathlib import Path
 from typing import List
 
-from airflow.hooks.base import BaseHook
-from airflow.utils.trigger_rule import TriggerRule
-from loguru import logger
+from . import prepare_task_environment
 
 STAGE = getenv("STAGE", "dev")
 IS_PROD = STAGE == "prod"
@@ -42,6 +43,8 @@ def basic_loguru(
     kwargs.setdefault("colorize", colorize)
     kwargs.setdefault("level", level)
 
+    from loguru import logger
+
     logger.remove()  # All configured handlers are removed
     logger.add(**kwargs)
     return logger
@@ -69,9 +72,11 @@ default_args = {
     "sla": timedelta(minutes=15),
     "execution_timeout": timedelta(minutes=30),
     # https://marclamberti.com/blog/airflow-trigger-rules-all-you-need-to-know/
-    "trigger_rule": TriggerRule.ALL_SUCCESS,
+    "trigger_rule": "all_success",  # TriggerRule.ALL_SUCCESS
     # "queue": "bash_queue",
     "priority_weight": 1,  # default is 1, higher value, lower priority
+    # connections & checks needed by the tasks, not by the parsing
+    "pre_execute": prepare_task_environment,
     # "on_failure_callback": some_function,
     # "on_success_callback": some_other_function,
     # "on_retry_callback": another_function,
@@ -79,3 +84,11 @@ default_args = {
     "run_as_user": None,
 }
 
+
+def __getattr__(name: str):
+    """lazy `logger`, not exported by star imports"""
+    if name == "logger":
+        from loguru import logger
+
+        return logger
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
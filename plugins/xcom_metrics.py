@@ -0,0 +1,46 @@
+"""logs how much of a task was spent on xcom i/o, once it finishes.
+
+the raw task runs in a forked process which ends with os._exit (atexit
+handlers never run), listeners are called from it right after the task
+instance state is flushed, in the process that did the i/o.
+
+https://airflow.apache.org/docs/apache-airflow/2.3.1/listeners.html"""
+import logging
+import sys
+
+from airflow.listeners import hookimpl
+from airflow.plugins_manager import AirflowPlugin
+
+log = logging.getLogger("airflow.task")
+
+
+def log_xcom_summary(task_instance, state: str):
+    # no import, the backend is loaded only if the task used xcom
+    backend = sys.modules.get("s3_xcom_backend")
+    if backend is None:
+        return
+    summary = backend.S3XComBackend.metrics_summary()
+    if not summary:
+        return
+    log.info(
+        "xcom i/o of %s.%s (%s): %s",
+        task_instance.dag_id,
+        task_instance.task_id,
+        state,
+        ", ".join(f"{k}={round(v, 3)}" for k, v in summary.items()),
+    )
+
+
+@hookimpl
+def on_task_instance_success(previous_state, task_instance, session):
+    log_xcom_summary(task_instance, "success")
+
+
+@hookimpl
+def on_task_instance_failed(previous_state, task_instance, session):
+    log_xcom_summary(task_instance, "failed")
+
+
+class XComMetricsPlugin(AirflowPlugin):
+    name = "xcom_metrics"
+    listeners = [sys.modules[__name__]]
@@ -1,14 +1,50 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from base64 import b64encode
+from copy import deepcopy
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from hashlib import sha1, sha256
+from io import BufferedReader, BytesIO, RawIOBase, SEEK_CUR, SEEK_END, SEEK_SET
+from math import isfinite
 from os import getenv
-from typing import Any
+from pathlib import Path
+from tempfile import SpooledTemporaryFile, TemporaryFile
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sys
 import uuid
 import json
 
 from pandas import DataFrame as DaFe
 import pandas as pd
 from airflow.models.xcom import BaseXCom
+from airflow.utils.session import NEW_SESSION, provide_session
 
+log = logging.getLogger(__name__)
 
-def s3_hook(aws_conn_id="AWSS3LogStorage"):
+
+def s3_hook(aws_conn_id="AWSS3LogStorage", **kwargs):
     """needed to fix a bug
 
     ImportError: cannot import name 'S3Hook' from partially initialized module
@@ -16,64 +52,1556 @@ def s3_hook(aws_conn_id="AWSS3LogStorage"):
     (most likely due to a circular import)"""
     from airflow.providers.amazon.aws.hooks.s3 import S3Hook
 
-    return S3Hook(aws_conn_id=aws_conn_id)
+    return S3Hook(aws_conn_id=aws_conn_id, **kwargs)
+
+
+# botocore clients are thread safe, one per process is enough; resolving the
+# connection costs a metadata db query and every new client a tls handshake
+S3_MAX_POOL_CONNECTIONS = int(getenv("XCOM_S3_MAX_POOL_CONNECTIONS", 32))
+_S3_CLIENTS: Dict[str, Tuple[int, Any]] = {}
+_S3_CLIENTS_LOCK = Lock()
+
+
+def s3_client(aws_conn_id="AWSS3LogStorage"):
+    """process wide cached s3 client, rebuilt after a fork (celery workers,
+    task runners) because sockets of the pool can't be shared with the
+    parent process"""
+    with _S3_CLIENTS_LOCK:
+        pid, client = _S3_CLIENTS.get(aws_conn_id, (None, None))
+        if pid != os.getpid():
+            from botocore.config import Config
+
+            config = Config(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                retries={"max_attempts": 5, "mode": "adaptive"},
+            )
+            client = s3_hook(aws_conn_id, config=config).get_conn()
+            _S3_CLIENTS[aws_conn_id] = (os.getpid(), client)
+        return client
+
+
+def _reset_s3_clients():
+    # the lock may have been held by another thread while forking
+    global _S3_CLIENTS_LOCK
+    _S3_CLIENTS_LOCK = Lock()
+    _S3_CLIENTS.clear()
+
+
+os.register_at_fork(after_in_child=_reset_s3_clients)
+
+
+# DataFrame payloads, "parquet" (smaller) or "arrow" (feather v2 / arrow ipc,
+# faster to encode & decode, good for intra pipeline handoffs)
+DATAFRAME_FORMAT = getenv("XCOM_S3_DATAFRAME_FORMAT", "parquet")
+PARQUET_COMPRESSION = getenv("XCOM_S3_PARQUET_COMPRESSION", "snappy")
+PARQUET_ROW_GROUP_SIZE = int(getenv("XCOM_S3_PARQUET_ROW_GROUP_SIZE", 0))
+ARROW_COMPRESSION = getenv("XCOM_S3_ARROW_COMPRESSION", "lz4")
+# any other payload, "json" (orjson if it's installed) or "msgpack" (keeps
+# bytes, datetimes & Decimals), compressed with "none", "gzip" or "zstd".
+# json is lossy, these come back as: datetimes, dates & times -> isoformat
+# str, Decimal -> str, bytes -> base64 str, tuples & sets -> list, non str
+# dict keys -> str; NaN & infinities are kept (stdlib json, not orjson)
+OBJECT_FORMAT = getenv("XCOM_S3_OBJECT_FORMAT", "json")
+OBJECT_COMPRESSION = getenv("XCOM_S3_OBJECT_COMPRESSION", "none")
+
+
+class Serializer(NamedTuple):
+    """how a payload is written into / read from an s3 object, the suffix
+    is appended to the s3 key so deserialize_value knows how to read it"""
+
+    suffix: str
+    dump: Callable[[Any, IO[bytes]], None]
+    load: Callable[[IO[bytes]], Any]
+
+
+def _codec(name: str) -> Optional[str]:
+    return None if name.lower() in ("none", "uncompressed", "") else name
+
+
+def _dump_parquet(value: DaFe, buffer: IO[bytes]):
+    value.to_parquet(
+        buffer,
+        compression=_codec(PARQUET_COMPRESSION),
+        row_group_size=PARQUET_ROW_GROUP_SIZE or None,
+    )
+
+
+def _dump_arrow(value: DaFe, buffer: IO[bytes]):
+    from pyarrow import Table, feather
+
+    # keeps the index, unlike DataFrame.to_feather which refuses it
+    table = Table.from_pandas(value)
+    compression = _codec(ARROW_COMPRESSION) or "uncompressed"
+    feather.write_feather(table, buffer, compression=compression)
+
+
+def _load_arrow(file: IO[bytes]) -> DaFe:
+    from pyarrow import feather
+
+    return feather.read_table(file).to_pandas()
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError(
+            "zstd compressed xcom payloads require the zstandard library"
+        ) from error
+    return zstandard
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError as error:
+        raise ImportError("msgpack xcom payloads require msgpack") from error
+    return msgpack
+
+
+def _orjson():
+    try:
+        import orjson
+    except ImportError:
+        return None  # json from the standard library, slower but fine
+    return orjson
+
+
+def _json_default(value: Any) -> Any:
+    """json has no datetime, Decimal nor bytes, they're written as strings
+    (isoformat, exact decimal representation & base64)"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return b64encode(value).decode("ascii")
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if _is_instance(value, "numpy", "ndarray") or _is_instance(
+        value, "numpy", "generic"
+    ):
+        return value.tolist()  # orjson does it by itself
+    raise TypeError(f"{type(value).__name__} is not json serializable")
+
+
+def _has_non_finite(value: Any) -> bool:
+    """NaN or infinities anywhere in a document, orjson writes them as null"""
+    numpy = sys.modules.get("numpy")
+    pending = [value]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, float):
+            if not isfinite(item):
+                return True
+        elif isinstance(item, dict):
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            pending.extend(item)
+        elif numpy is not None and isinstance(
+            item, (numpy.ndarray, numpy.generic)
+        ):
+            if item.dtype.kind in "fc" and not numpy.isfinite(item).all():
+                return True
+    return False
+
+
+# still valid json, marks documents orjson can't read back as they were
+# (it reads ints over 64 bits as floats), decode_json uses the stdlib too
+_STDLIB_JSON = b" "
+
+
+def encode_json(value: Any) -> bytes:
+    """orjson when it can, it rejects ints over 64 bits & turns NaN into
+    null, those documents are written by the standard library"""
+    orjson = _orjson()
+    if orjson is not None:
+        try:
+            encoded = orjson.dumps(
+                value,
+                default=_json_default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+            )
+        except TypeError:
+            pass
+        else:  # only documents with a null may have had a NaN
+            if b"null" not in encoded or not _has_non_finite(value):
+                return encoded
+    encoded = json.dumps(value, default=_json_default, separators=(",", ":"))
+    return _STDLIB_JSON + encoded.encode("UTF-8")
+
+
+def decode_json(encoded: bytes) -> Any:
+    orjson = _orjson()
+    if orjson is None or encoded.startswith(_STDLIB_JSON):
+        return json.loads(encoded)
+    try:
+        return orjson.loads(encoded)
+    except ValueError:  # NaN, written by a worker without orjson
+        return json.loads(encoded)
+
+
+# unlike json, msgpack keeps bytes & these types when the value comes back
+_MSGPACK_DATETIME, _MSGPACK_DATE, _MSGPACK_TIME, _MSGPACK_DECIMAL = 1, 2, 3, 4
+
+
+def _msgpack_default(value: Any) -> Any:
+    ext_type = _msgpack().ExtType
+    if isinstance(value, datetime):
+        return ext_type(_MSGPACK_DATETIME, value.isoformat().encode())
+    if isinstance(value, date):
+        return ext_type(_MSGPACK_DATE, value.isoformat().encode())
+    if isinstance(value, time):
+        return ext_type(_MSGPACK_TIME, value.isoformat().encode())
+    if isinstance(value, Decimal):
+        return ext_type(_MSGPACK_DECIMAL, str(value).encode())
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if _is_instance(value, "numpy", "ndarray") or _is_instance(
+        value, "numpy", "generic"
+    ):
+        return value.tolist()  # as json does
+    raise TypeError(f"{type(value).__name__} is not msgpack serializable")
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    decoders = {
+        _MSGPACK_DATETIME: datetime.fromisoformat,
+        _MSGPACK_DATE: date.fromisoformat,
+        _MSGPACK_TIME: time.fromisoformat,
+        _MSGPACK_DECIMAL: Decimal,
+    }
+    if code not in decoders:
+        return _msgpack().ExtType(code, data)
+    return decoders[code](data.decode())
+
+
+def encode_msgpack(value: Any) -> bytes:
+    return _msgpack().packb(value, default=_msgpack_default, use_bin_type=True)
+
+
+def decode_msgpack(encoded: bytes) -> Any:
+    return _msgpack().unpackb(
+        encoded, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False
+    )
+
+
+ENCODERS: Dict[str, Callable[[Any], bytes]] = {
+    "json": encode_json,
+    "msgpack": encode_msgpack,
+}
+
+
+# document serializers receive the already encoded value, it's encoded
+# beforehand to decide whether it's small enough to be stored inline
+def _dump_encoded(encoded: bytes, buffer: IO[bytes]):
+    buffer.write(encoded)
+
+
+def _dump_gzip(encoded: bytes, buffer: IO[bytes]):
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=6) as file:
+        file.write(encoded)
+
+
+def _dump_zstd(encoded: bytes, buffer: IO[bytes]):
+    with _zstd().ZstdCompressor().stream_writer(buffer, closefd=False) as file:
+        file.write(encoded)
+
+
+def _read_gzip(file: IO[bytes]) -> bytes:
+    with gzip.GzipFile(fileobj=file, mode="rb") as decompressed:
+        return decompressed.read()
+
+
+def _read_zstd(file: IO[bytes]) -> bytes:
+    reader = _zstd().ZstdDecompressor().stream_reader(file, closefd=False)
+    with reader as decompressed:
+        return decompressed.read()
+
+
+def _document_serializers(
+    name: str, suffix: str, decode: Callable[[bytes], Any]
+) -> Dict[str, Serializer]:
+    """plain, gzip & zstd variants of an encoding"""
+    return {
+        name: Serializer(suffix, _dump_encoded, lambda x: decode(x.read())),
+        f"{name}+gzip": Serializer(
+            f"{suffix}.gz", _dump_gzip, lambda x: decode(_read_gzip(x))
+        ),
+        f"{name}+zstd": Serializer(
+            f"{suffix}.zst", _dump_zstd, lambda x: decode(_read_zstd(x))
+        ),
+    }
+
+
+# arrow tables, polars DataFrames & numpy arrays are written as they are,
+# no pandas conversion in between, and they come back with the same type
+def _dump_arrow_table(value, buffer: IO[bytes]):
+    from pyarrow import feather
+
+    compression = _codec(ARROW_COMPRESSION) or "uncompressed"
+    feather.write_feather(value, buffer, compression=compression)
+
+
+def _load_arrow_table(file: IO[bytes]):
+    from pyarrow import feather
+
+    return feather.read_table(file)
+
+
+def _dump_polars(value, buffer: IO[bytes]):
+    compression = _codec(ARROW_COMPRESSION) or "uncompressed"
+    value.write_ipc(buffer, compression=compression)
+
+
+def _load_polars(file: IO[bytes]):
+    import polars
+
+    return polars.read_ipc(file)
+
+
+def _dump_numpy(value, buffer: IO[bytes]):
+    import numpy
+
+    numpy.save(buffer, value, allow_pickle=False)
+
+
+def _load_numpy(file: IO[bytes]):
+    import numpy
+
+    return numpy.load(file, allow_pickle=False)
+
+
+SERIALIZERS: Dict[str, Serializer] = {
+    "parquet": Serializer(".parquet", _dump_parquet, pd.read_parquet),
+    "arrow": Serializer(".arrow", _dump_arrow, _load_arrow),
+    "arrow_table": Serializer(
+        ".pa.arrow", _dump_arrow_table, _load_arrow_table
+    ),
+    "polars": Serializer(".pl.arrow", _dump_polars, _load_polars),
+    "numpy": Serializer(".npy", _dump_numpy, _load_numpy),
+    **_document_serializers("json", ".json", decode_json),
+    **_document_serializers("msgpack", ".msgpack", decode_msgpack),
+    # read only, kept for objects written by hand / older versions
+    "csv": Serializer(".csv", DaFe.to_csv, pd.read_csv),
+}
+
+
+def _format_name(serializer: Serializer) -> str:
+    return next(k for k, v in SERIALIZERS.items() if v is serializer)
+
+
+def serializer_for_key(key: str) -> Serializer:
+    """longest suffix wins, i.e. '.json.gz' over '.json'"""
+    for serializer in sorted(
+        SERIALIZERS.values(), key=lambda x: len(x.suffix), reverse=True
+    ):
+        if key.endswith(serializer.suffix):
+            return serializer
+    # has s3 xcom backend prefix (was custom serialized)
+    raise ValueError(f"unknown file format for {key}")
+
+
+def _is_instance(value: Any, module: str, name: str) -> bool:
+    """isinstance without importing optional libraries, if the module was
+    never imported the value can't be an instance of it"""
+    module = sys.modules.get(module)
+    return module is not None and isinstance(value, getattr(module, name))
+
+
+def binary_format(value: Any) -> Optional[str]:
+    """SERIALIZERS entry for values stored as they are (never inline)"""
+    if isinstance(value, pd.DataFrame):
+        return DATAFRAME_FORMAT
+    if _is_instance(value, "pyarrow", "Table"):
+        return "arrow_table"
+    if _is_instance(value, "polars", "DataFrame"):
+        return "polars"
+    if _is_instance(value, "numpy", "ndarray"):
+        return "numpy"
+    return None
+
+
+def document_serializer(object_format: str = OBJECT_FORMAT) -> Serializer:
+    compression = _codec(OBJECT_COMPRESSION)
+    return SERIALIZERS[
+        f"{object_format}+{compression}" if compression else object_format
+    ]
+
+
+def encode_document(value: Any) -> Tuple[bytes, Serializer]:
+    """encodes with OBJECT_FORMAT, documents msgpack can't encode (i.e.
+    ints over 64 bits) are written as json instead"""
+    try:
+        return ENCODERS[OBJECT_FORMAT](value), document_serializer()
+    except (TypeError, ValueError, OverflowError):
+        if OBJECT_FORMAT == "json":
+            raise
+    return encode_json(value), document_serializer("json")
+
+
+def serializer_for_value(value: Any) -> Serializer:
+    if binary_format(value):
+        return SERIALIZERS[binary_format(value)]
+    return document_serializer()
+
+
+class _S3RangeReader(RawIOBase):
+    """read only & seekable view of an s3 object, every read is a ranged
+    GET, so parquet readers only fetch the footer and the column chunks /
+    row groups they need instead of the whole object"""
+
+    def __init__(self, client, bucket_name: str, key: str):
+        super().__init__()
+        self._client = client
+        self._bucket_name = bucket_name
+        self._key = key
+        self._position = 0
+        self.size = client.head_object(Bucket=bucket_name, Key=key)[
+            "ContentLength"
+        ]
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = SEEK_SET) -> int:
+        if whence == SEEK_CUR:
+            offset += self._position
+        elif whence == SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self.size or not len(buffer):
+            return 0
+        last_byte = min(self._position + len(buffer), self.size) - 1
+        body = self._client.get_object(
+            Bucket=self._bucket_name,
+            Key=self._key,
+            Range=f"bytes={self._position}-{last_byte}",
+        )["Body"].read()
+        buffer[: len(body)] = body
+        self._position += len(body)
+        return len(body)
+
+
+class _S3MultipartWriter(RawIOBase):
+    """write only file object which uploads each part as soon as it's
+    filled, so encoding (i.e. parquet row groups) and upload overlap
+    instead of running one after the other. At most `max_concurrency`
+    parts are kept in memory, the upload is aborted if anything fails."""
+
+    MIN_PART_SIZE = 5 * 1024 * 1024  # s3 limit, except for the last part
+
+    def __init__(
+        self,
+        client,
+        bucket_name: str,
+        key: str,
+        part_size: int,
+        max_concurrency: int,
+    ):
+        super().__init__()
+        self._client = client
+        self._bucket_name = bucket_name
+        self._key = key
+        self._part_size = max(part_size, self.MIN_PART_SIZE)
+        self._upload_id = client.create_multipart_upload(
+            Bucket=bucket_name, Key=key
+        )["UploadId"]
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._slots = BoundedSemaphore(max_concurrency)
+        self._parts: List[Future] = []
+        self._buffer = bytearray()
+        self._written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._written
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._written += len(data)
+        while len(self._buffer) >= self._part_size:
+            self._submit(bytes(self._buffer[: self._part_size]))
+            del self._buffer[: self._part_size]
+        return len(data)
+
+    def _submit(self, body: bytes):
+        for part in self._parts:  # fail fast, don't keep encoding
+            if part.done() and part.exception():
+                raise part.exception()
+        self._slots.acquire()  # backpressure, blocks the encoder
+        self._parts.append(
+            self._executor.submit(
+                self._upload_part, len(self._parts) + 1, body
+            )
+        )
+
+    def _upload_part(self, number: int, body: bytes) -> dict:
+        try:
+            response = self._client.upload_part(
+                Bucket=self._bucket_name,
+                Key=self._key,
+                UploadId=self._upload_id,
+                PartNumber=number,
+                Body=body,
+            )
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        finally:
+            self._slots.release()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer or not self._parts:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            self._client.complete_multipart_upload(
+                Bucket=self._bucket_name,
+                Key=self._key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": [p.result() for p in self._parts]},
+            )
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._executor.shutdown()
+            super().close()
+
+    def abort(self):
+        for part in self._parts:
+            part.cancel()
+        self._executor.shutdown()
+        self._client.abort_multipart_upload(
+            Bucket=self._bucket_name, Key=self._key, UploadId=self._upload_id
+        )
+        super().close()
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None and not self.closed:
+            self.abort()
+        else:
+            self.close()
+
+
+def _deep_sizeof(value: Any) -> int:
+    """sys.getsizeof of a document and of everything it contains"""
+    size, seen, pending = 0, set(), [value]
+    while pending:
+        item = pending.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            pending.extend(item)
+    return size
+
+
+class _PayloadCache:
+    """byte-size aware LRU of deserialized payloads, keyed by s3 key.
+
+    keys are never overwritten (they carry an uuid) so entries never get
+    stale, cached values are copied on the way out because consumers are
+    free to mutate what they pulled. Sizes are of the deserialized values,
+    values bigger than max_entry_bytes aren't cached, so pulling a big
+    payload once doesn't keep a second copy of it in memory. The optional
+    disk tier keeps the raw s3 objects, so other processes in the same
+    host (i.e. forked task runners) can skip the download too."""
+
+    _MISSING = object()
+
+    def __init__(
+        self,
+        max_bytes: int,
+        max_entry_bytes: Optional[int] = None,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 0,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes or max_bytes, max_bytes)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        self.hits = self.misses = self.disk_hits = self.disk_misses = 0
+
+    @staticmethod
+    def _detached(value: Any) -> Any:
+        if isinstance(value, pd.DataFrame):
+            return value.copy(deep=True)
+        if _is_instance(value, "pyarrow", "Table"):
+            return value  # immutable
+        if _is_instance(value, "polars", "DataFrame"):
+            return value.clone()
+        return deepcopy(value)
+
+    def get(self, key: str) -> Any:
+        """returns a copy of the cached value or _MISSING"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return self._MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return self._detached(entry[0])
+
+    def put(self, key: str, value: Any, size: int) -> Any:
+        """caches value (when it fits) and returns a copy safe to hand out"""
+        if size > self.max_entry_bytes:
+            return value  # not cached, no need to copy it
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+        return self._detached(value)
+
+    def clear(self):
+        """empties the memory tier, the disk tier is shared, it's kept"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / sha1(key.encode()).hexdigest()
+
+    def disk_get(self, key: str) -> Optional[IO[bytes]]:
+        """opens the raw payload from the disk tier if it's there"""
+        if not self.disk_dir:
+            return None
+        try:
+            file = open(self._disk_path(key), "rb")
+        except OSError as error:
+            if not isinstance(error, FileNotFoundError):
+                log.warning("xcom disk cache unavailable: %s", error)
+            self.disk_misses += 1
+            return None
+        os.utime(file.fileno())  # refresh the lru position across processes
+        self.disk_hits += 1
+        return file
+
+    def disk_put(self, key: str, buffer: IO[bytes], size: int):
+        """stores a raw payload (the whole buffer) in the disk tier, buffer
+        is rewound. The disk tier is an optimization, a full or read only
+        volume is logged, it never fails an xcom push/pull"""
+        if not self.disk_dir or size > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            buffer.seek(0)
+            with open(tmp_path, "wb") as file:
+                shutil.copyfileobj(buffer, file)
+            os.replace(tmp_path, path)  # atomic, no partial files are read
+            self._disk_evict()
+        except OSError as error:
+            log.warning("could not write to the xcom disk cache: %s", error)
+            tmp_path.unlink(missing_ok=True)
+        finally:
+            buffer.seek(0)
+
+    def _disk_evict(self):
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".tmp"):  # still being written
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "disk_misses": self.disk_misses,
+            "entries": len(self._entries),
+            "bytes": self._size,
+        }
+
+
+class _XComMetrics:
+    """timers & counters sent through airflow's Stats client (statsd, when
+    [metrics] statsd_on) and added up per process for the task summary.
+
+    plain statsd doesn't support tags, so every metric is sent twice, as
+    xcom_s3.<name> and scoped as xcom_s3.<dag_id>.<task_id>.<name>. The
+    dag/task is the one running in this process (the AIRFLOW_CTX_* variables
+    airflow sets before executing a task), not the one which pushed."""
+
+    PREFIX = "xcom_s3"
+
+    def __init__(self):
+        self._lock = Lock()
+        self._totals: Dict[str, float] = {}
+
+    def _names(self, name: str) -> List[str]:
+        names = [f"{self.PREFIX}.{name}"]
+        dag_id = getenv("AIRFLOW_CTX_DAG_ID")
+        task_id = getenv("AIRFLOW_CTX_TASK_ID")
+        if dag_id and task_id:
+            names.append(f"{self.PREFIX}.{dag_id}.{task_id}.{name}")
+        return names
+
+    def _add(self, name: str, amount: float):
+        with self._lock:
+            self._totals[name] = self._totals.get(name, 0) + amount
+
+    def incr(self, name: str, count: int = 1):
+        from airflow.stats import Stats
+
+        self._add(name, count)
+        for stat in self._names(name):
+            Stats.incr(stat, count)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """times the block, failures are counted as <name>.errors"""
+        from airflow.stats import Stats
+
+        start = perf_counter()
+        try:
+            yield
+        except Exception:
+            self.incr(f"{name}.errors")
+            raise
+        elapsed = perf_counter() - start
+        self._add(f"{name}.seconds", elapsed)
+        self._add(f"{name}.calls", 1)
+        for stat in self._names(name):
+            Stats.timing(stat, timedelta(seconds=elapsed))
+
+    def summary(self, reset: bool = True) -> Dict[str, float]:
+        """totals since the last reset (i.e. of the task which just ran)"""
+        with self._lock:
+            totals = dict(sorted(self._totals.items()))
+            if reset:
+                self._totals.clear()
+        return totals
 
 
 class S3XComBackend(BaseXCom):
     """https://www.astronomer.io/guides/custom-xcom-backends"""
 
     VALUE_PREFIX = "xcom_s3://"
-    BUCKET_NAME = getenv("REMOTE_BASE_LOG_BUCKET", "prod-airflows-logs")
+    # dedicated bucket (see XCOM_BUCKET_CONFIG), the log bucket used to be
+    # shared with xcom and still is when XCOM_S3_BUCKET isn't set
+    LEGACY_BUCKET_NAME = getenv("REMOTE_BASE_LOG_BUCKET", "prod-airflows-logs")
+    BUCKET_NAME = getenv("XCOM_S3_BUCKET") or LEGACY_BUCKET_NAME
+    # references have no bucket, the ones written to the log bucket (flat
+    # keys, before the per run layout) are still read & purged from there
+    LEGACY_KEY_PREFIX = "xcom/data_"
+    # pushes without dag/task/run (i.e. serialize_value called by hand)
+    UNSCOPED_PREFIX = "xcom/unscoped/"
+    # payloads bigger than this are spilled to a temporary file (deleted on
+    # close) instead of being kept in memory while streaming to/from s3
+    SPILL_THRESHOLD_BYTES = int(
+        getenv("XCOM_S3_SPILL_THRESHOLD_BYTES", 256 * 1024 * 1024)
+    )
+    # json encoded values smaller than this stay inline in the metadata db,
+    # an s3 round trip costs more than the row itself; DataFrames, arrays
+    # & arrow tables always go to s3 because they cannot be stored inline
+    INLINE_THRESHOLD_BYTES = int(
+        getenv("XCOM_S3_INLINE_THRESHOLD_BYTES", 64 * 1024)
+    )
+    # deserialize_value returns a LazyXComValue, the payload is downloaded
+    # only when a task actually uses it
+    LAZY = getenv("XCOM_S3_LAZY", "False") == "True"
+    # repeated pulls of the same key are served from this process (memory)
+    # or from this host (disk, only if XCOM_S3_CACHE_DIR is set), pushes
+    # are written to the disk tier too, so tasks of the same run placed in
+    # the same worker instance skip the download
+    CACHE = _PayloadCache(
+        max_bytes=int(getenv("XCOM_S3_CACHE_MAX_BYTES", 128 * 1024 * 1024)),
+        max_entry_bytes=int(
+            getenv("XCOM_S3_CACHE_MAX_ENTRY_BYTES", 32 * 1024 * 1024)
+        ),
+        disk_dir=getenv("XCOM_S3_CACHE_DIR"),
+        disk_max_bytes=int(
+            getenv("XCOM_S3_CACHE_DIR_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+        ),
+    )
+    # objects bigger than the threshold are transferred in parts of
+    # MULTIPART_CHUNK_BYTES, up to MAX_CONCURRENCY parts at the same time
+    MULTIPART_THRESHOLD_BYTES = int(
+        getenv("XCOM_S3_MULTIPART_THRESHOLD_BYTES", 64 * 1024 * 1024)
+    )
+    MULTIPART_CHUNK_BYTES = int(
+        getenv("XCOM_S3_MULTIPART_CHUNK_BYTES", 16 * 1024 * 1024)
+    )
+    MAX_CONCURRENCY = int(getenv("XCOM_S3_MAX_CONCURRENCY", 8))
+    # keys are the sha256 of the serialized payload, identical results
+    # (mapped tasks, retries) are uploaded once; objects under CAS_PREFIX
+    # may be referenced by several xcom rows. Pushing an existing object
+    # older than CAS_REFRESH_SECONDS copies it onto itself (billed as a
+    # put), so its LastModified (what reap_orphans' min_age & the bucket
+    # expiration look at) is never far from the one of the newest row
+    # referencing it, younger ones cost a HEAD only
+    CONTENT_ADDRESSED = getenv("XCOM_S3_CONTENT_ADDRESSED", "False") == "True"
+    CAS_PREFIX = "xcom/cas/"
+    # keep it well below reap_orphans' min_age
+    CAS_REFRESH_SECONDS = float(
+        getenv("XCOM_S3_CAS_REFRESH_SECONDS", 6 * 60 * 60)
+    )
+    # other objects are grouped by run under a hash shard (see run_prefix)
+    # so request rate spreads across s3 partitions, a run can be listed or
+    # deleted on its own and lifecycle rules can target a dag
+    KEY_SHARDS = int(getenv("XCOM_S3_KEY_SHARDS", 256))
+    # summary logged at the end of every task by plugins/xcom_metrics.py
+    METRICS = _XComMetrics()
 
     @staticmethod
-    def serialize_value(value: Any, *args, **kwargs):
-        key = f"data_{str(uuid.uuid4())}{{}}"
-        filename = f"/tmp/{key}"
-        key = "xcom/" + key
+    def bucket_for(key: str) -> str:
+        """bucket a referenced key lives in"""
+        if key.startswith(S3XComBackend.LEGACY_KEY_PREFIX):
+            return S3XComBackend.LEGACY_BUCKET_NAME
+        return S3XComBackend.BUCKET_NAME
 
-        if isinstance(value, pd.DataFrame):
-            key = key.format(".parquet")
-            value.to_parquet(filename)
-            s3_hook().load_file(
-                filename=filename,
-                key=key,
-                bucket_name=S3XComBackend.BUCKET_NAME,
-                replace=True,
+    @staticmethod
+    def _spooled_buffer() -> IO[bytes]:
+        """in-memory buffer which rolls over to disk above the threshold"""
+        return SpooledTemporaryFile(
+            max_size=S3XComBackend.SPILL_THRESHOLD_BYTES, mode="w+b"
+        )
+
+    @staticmethod
+    def _transfer_config():
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=S3XComBackend.MULTIPART_THRESHOLD_BYTES,
+            multipart_chunksize=S3XComBackend.MULTIPART_CHUNK_BYTES,
+            max_concurrency=S3XComBackend.MAX_CONCURRENCY,
+        )
+
+    @staticmethod
+    def _upload(buffer: IO[bytes], key: str):
+        size = buffer.seek(0, SEEK_END)
+        buffer.seek(0)
+        with S3XComBackend.METRICS.timer("upload"):
+            s3_client().upload_fileobj(
+                buffer,
+                S3XComBackend.BUCKET_NAME,
+                key,
+                Config=S3XComBackend._transfer_config(),
             )
-            value = S3XComBackend.VALUE_PREFIX + key
-
-        elif not isinstance(value, (str, list)):
-            key = key.format(".json")
-            with open(filename, "w") as f:
-                json.dump(json.loads(str(value)), f)
-
-            s3_hook().load_file(
-                filename=filename,
-                key=key,
-                bucket_name=S3XComBackend.BUCKET_NAME,
-                replace=True,
+        S3XComBackend.METRICS.incr("bytes_written", size)
+
+    @staticmethod
+    def _multipart_writer(key: str) -> _S3MultipartWriter:
+        return _S3MultipartWriter(
+            s3_client(),
+            S3XComBackend.BUCKET_NAME,
+            key,
+            part_size=S3XComBackend.MULTIPART_CHUNK_BYTES,
+            max_concurrency=S3XComBackend.MAX_CONCURRENCY,
+        )
+
+    @staticmethod
+    def _download(key: str) -> Tuple[IO[bytes], int]:
+        """streams the object into memory, or into an anonymous temporary
+        file if it's bigger than the spill threshold, ready to be read"""
+        buffer = S3XComBackend.CACHE.disk_get(key)
+        if buffer:
+            S3XComBackend.METRICS.incr("cache.disk_hits")
+            return buffer, os.fstat(buffer.fileno()).st_size
+
+        client = s3_client()
+        with S3XComBackend.METRICS.timer("download"):
+            bucket_name = S3XComBackend.bucket_for(key)
+            size = client.head_object(Bucket=bucket_name, Key=key)[
+                "ContentLength"
+            ]
+            if size > S3XComBackend.SPILL_THRESHOLD_BYTES:
+                buffer = TemporaryFile(mode="w+b")
+            else:
+                buffer = BytesIO()
+            client.download_fileobj(
+                bucket_name,
+                key,
+                buffer,
+                Config=S3XComBackend._transfer_config(),
             )
-            value = S3XComBackend.VALUE_PREFIX + key
+        S3XComBackend.METRICS.incr("bytes_read", size)
+        buffer.seek(0)
+        S3XComBackend.CACHE.disk_put(key, buffer, size)
+        return buffer, size
+
+    @staticmethod
+    def cache_stats() -> Dict[str, int]:
+        """hit/miss counters of the payload cache of this process"""
+        return S3XComBackend.CACHE.stats()
+
+    @staticmethod
+    def metrics_summary(reset: bool = True) -> Dict[str, float]:
+        """xcom i/o totals of this process since the last reset"""
+        return S3XComBackend.METRICS.summary(reset)
+
+    @staticmethod
+    def _in_memory_size(payload: Any) -> int:
+        """rough size of binary payloads, json payloads are already bytes
+        smaller than the multipart threshold most of the time"""
+        if isinstance(payload, pd.DataFrame):
+            return int(payload.memory_usage(deep=False).sum())
+        if _is_instance(payload, "polars", "DataFrame"):
+            return int(payload.estimated_size())
+        if isinstance(payload, (bytes, bytearray)):
+            return 0  # json, already encoded, buffering it costs nothing
+        return int(getattr(payload, "nbytes", 0))  # arrow tables & ndarrays
+
+    @staticmethod
+    def _decoded_size(result: Any) -> int:
+        """memory taken by a deserialized payload, what the cache charges"""
+        if isinstance(result, pd.DataFrame):  # strings are python objects
+            return int(result.memory_usage(deep=True).sum())
+        if binary_format(result):
+            return S3XComBackend._in_memory_size(result)
+        return _deep_sizeof(result)
+
+    @staticmethod
+    def _last_modified(key: str) -> Optional[datetime]:
+        """None if the object doesn't exist"""
+        from botocore.exceptions import ClientError
+
+        try:
+            response = s3_client().head_object(
+                Bucket=S3XComBackend.BUCKET_NAME, Key=key
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
+        return response["LastModified"]
+
+    @staticmethod
+    def _refresh(key: str) -> bool:
+        """copies an object onto itself, so it starts aging again (lifecycle
+        expiration, reap_orphans), False if it doesn't exist"""
+        from botocore.exceptions import ClientError
+
+        try:
+            s3_client().copy(
+                {"Bucket": S3XComBackend.BUCKET_NAME, "Key": key},
+                S3XComBackend.BUCKET_NAME,
+                key,
+                ExtraArgs={"MetadataDirective": "REPLACE"},
+                Config=S3XComBackend._transfer_config(),
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+        S3XComBackend.METRICS.incr("cas.refreshes")
+        return True
+
+    @staticmethod
+    def _store_content_addressed(payload: Any, serializer: Serializer) -> str:
+        """the whole payload must be encoded before knowing its key, so it
+        never uses the streaming multipart writer"""
+        with S3XComBackend._spooled_buffer() as buffer:
+            S3XComBackend._dump(payload, serializer, buffer)
+            buffer.seek(0)
+            digest = sha256()
+            for chunk in iter(lambda: buffer.read(1024 * 1024), b""):
+                digest.update(chunk)
+            key = f"{S3XComBackend.CAS_PREFIX}{digest.hexdigest()}"
+            key += serializer.suffix
+            last_modified = S3XComBackend._last_modified(key)
+            refresh_before = datetime.now(timezone.utc) - timedelta(
+                seconds=S3XComBackend.CAS_REFRESH_SECONDS
+            )
+            if last_modified is None or (
+                last_modified < refresh_before
+                and not S3XComBackend._refresh(key)  # deleted meanwhile
+            ):
+                S3XComBackend._write_through(key, buffer)
+                S3XComBackend._upload(buffer, key)
+        return S3XComBackend.VALUE_PREFIX + key
+
+    @staticmethod
+    def _write_through(key: str, buffer: IO[bytes]):
+        """keeps what is being uploaded in the disk tier, downstream tasks
+        running in the same host (XCOM_S3_CACHE_DIR is a host volume in the
+        workers) won't download it"""
+        S3XComBackend.CACHE.disk_put(key, buffer, buffer.seek(0, SEEK_END))
+
+    @staticmethod
+    def run_prefix(dag_id: str, run_id: str) -> str:
+        """i.e. xcom/3f/etl/scheduled__2022-06-01T00:00:00+00:00/
+
+        the shard comes from dag_id & run_id, so a run shares one prefix"""
+        digest = sha1(f"{dag_id}/{run_id}".encode()).digest()
+        shard = int.from_bytes(digest[:4], "big") % S3XComBackend.KEY_SHARDS
+        return f"xcom/{shard:02x}/{dag_id}/{run_id}/"
+
+    @staticmethod
+    def _key_prefix(
+        dag_id: Optional[str] = None,
+        run_id: Optional[str] = None,
+        task_id: Optional[str] = None,
+        map_index: int = -1,
+        **kwargs,
+    ) -> str:
+        if not (dag_id and run_id and task_id):  # i.e. called by hand
+            return S3XComBackend.UNSCOPED_PREFIX
+        prefix = S3XComBackend.run_prefix(dag_id, run_id)
+        return f"{prefix}{task_id}/{map_index}/"
+
+    @staticmethod
+    def _dump(payload: Any, serializer: Serializer, buffer: IO[bytes]):
+        """documents come already encoded, they're only compressed here"""
+        if serializer.dump is _dump_encoded:
+            return serializer.dump(payload, buffer)
+        name = "compress" if isinstance(payload, bytes) else "serialize"
+        with S3XComBackend.METRICS.timer(name):
+            serializer.dump(payload, buffer)
+
+    @staticmethod
+    def _store(
+        payload: Any,
+        serializer: Serializer,
+        key_prefix: str = UNSCOPED_PREFIX,
+    ) -> str:
+        """uploads the payload, returns the reference stored in the db"""
+        if S3XComBackend.CONTENT_ADDRESSED:
+            return S3XComBackend._store_content_addressed(payload, serializer)
+        key = f"{key_prefix}data_{str(uuid.uuid4())}{serializer.suffix}"
+        if (
+            S3XComBackend._in_memory_size(payload)
+            >= S3XComBackend.MULTIPART_THRESHOLD_BYTES
+        ):  # big enough to encode & upload at the same time, timed as upload
+            with S3XComBackend.METRICS.timer("upload"):
+                with S3XComBackend._multipart_writer(key) as writer:
+                    serializer.dump(payload, writer)
+            S3XComBackend.METRICS.incr("bytes_written", writer.tell())
+        else:
+            with S3XComBackend._spooled_buffer() as buffer:
+                S3XComBackend._dump(payload, serializer, buffer)
+                # before the upload, s3transfer closes the buffer
+                S3XComBackend._write_through(key, buffer)
+                S3XComBackend._upload(buffer, key)
+        # multipart payloads were never fully in a buffer, they're cached
+        # by the first download
+        return S3XComBackend.VALUE_PREFIX + key
+
+    @staticmethod
+    def serialize_value(value: Any, *args, **kwargs):
+        # airflow passes key, dag_id, task_id, run_id & map_index as kwargs
+        key_prefix = S3XComBackend._key_prefix(**kwargs)
+        if binary_format(value):  # encoded by _store, while it's written
+            serializer = serializer_for_value(value)
+            value = S3XComBackend._store(value, serializer, key_prefix)
+        else:
+            with S3XComBackend.METRICS.timer("serialize"):
+                encoded, serializer = encode_document(value)
+            if len(encoded) < S3XComBackend.INLINE_THRESHOLD_BYTES:
+                try:  # json is about the size BaseXCom stores inline
+                    value = BaseXCom.serialize_value(value)
+                    S3XComBackend.METRICS.incr("format.inline")
+                    return value
+                except (TypeError, ValueError):
+                    pass  # i.e. datetimes, Decimals, bytes go to s3
+            value = S3XComBackend._store(encoded, serializer, key_prefix)
+        name = _format_name(serializer).replace("+", "_")  # statsd charset
+        S3XComBackend.METRICS.incr(f"format.{name}")
 
         return BaseXCom.serialize_value(value)
 
+    @staticmethod
+    def load(key: str) -> Any:
+        """downloads (or takes from the cache) and decodes an s3 payload"""
+        result = S3XComBackend.CACHE.get(key)
+        if result is not _PayloadCache._MISSING:
+            S3XComBackend.METRICS.incr("cache.hits")
+            return result
+
+        S3XComBackend.METRICS.incr("cache.misses")
+        return S3XComBackend._load_uncached(key)
+
+    @staticmethod
+    def _decode(key: str, file: IO[bytes]) -> Any:
+        serializer = serializer_for_key(key)
+        with file, S3XComBackend.METRICS.timer("deserialize"):
+            result = serializer.load(file)
+        size = S3XComBackend._decoded_size(result)
+        return S3XComBackend.CACHE.put(key, result, size)
+
+    @staticmethod
+    def _key_of(value: Any) -> Optional[str]:
+        if isinstance(value, LazyXComValue):
+            return value.key
+        if isinstance(value, str) and value.startswith(
+            S3XComBackend.VALUE_PREFIX
+        ):
+            return value.replace(S3XComBackend.VALUE_PREFIX, "")
+        return None
+
+    @staticmethod
+    async def fetch_many_async(keys: Iterable[str]) -> Dict[str, IO[bytes]]:
+        """downloads many objects concurrently (at most MAX_CONCURRENCY at
+        the same time) with aiobotocore, usable from triggers/deferrable
+        operators which already run inside an event loop. Returns them as
+        files ready to be read, the ones bigger than the spill threshold
+        are anonymous temporary files.
+
+        endpoint, region, credentials & settings are the ones of s3_client,
+        no connection lookup"""
+        from aiobotocore.config import AioConfig
+        from aiobotocore.session import get_session
+
+        sync_client = s3_client()
+        # botocore has no public getter, refreshed when they're about to expire
+        credentials = sync_client._request_signer._credentials
+        credentials = credentials.get_frozen_credentials()
+        config = sync_client.meta.config
+        semaphore = asyncio.Semaphore(S3XComBackend.MAX_CONCURRENCY)
+        async with get_session().create_client(
+            "s3",
+            region_name=sync_client.meta.region_name,
+            endpoint_url=sync_client.meta.endpoint_url,
+            aws_access_key_id=credentials.access_key,
+            aws_secret_access_key=credentials.secret_key,
+            aws_session_token=credentials.token,
+            config=AioConfig(
+                max_pool_connections=config.max_pool_connections,
+                retries=config.retries,
+                s3=config.s3,
+                signature_version=config.signature_version,
+            ),
+        ) as client:
+
+            async def fetch(key: str) -> Tuple[str, IO[bytes]]:
+                async with semaphore:
+                    response = await client.get_object(
+                        Bucket=S3XComBackend.bucket_for(key), Key=key
+                    )
+                    size = response["ContentLength"]
+                    if size > S3XComBackend.SPILL_THRESHOLD_BYTES:
+                        buffer = TemporaryFile(mode="w+b")
+                    else:
+                        buffer = BytesIO()
+                    chunk_size = S3XComBackend.MULTIPART_CHUNK_BYTES
+                    async with response["Body"] as stream:
+                        while chunk := await stream.read(chunk_size):
+                            buffer.write(chunk)
+                    buffer.seek(0)
+                    return key, buffer
+
+            return dict(await asyncio.gather(*(fetch(k) for k in keys)))
+
+    @staticmethod
+    def _load_uncached(key: str) -> Any:
+        file, _ = S3XComBackend._download(key)
+        return S3XComBackend._decode(key, file)
+
+    @staticmethod
+    def load_many(values: List[Any]) -> List[Any]:
+        """resolves every s3 reference / LazyXComValue in values with
+        concurrent downloads instead of one after the other, anything else
+        is returned as is, order is kept.
+
+        opt-in, ti.xcom_pull(task_ids=[...]) deserializes one row after the
+        other, use pull_many (or this with orm values) instead"""
+        results: Dict[str, Any] = {}
+        missing: List[str] = []
+        for key in {S3XComBackend._key_of(v) for v in values} - {None}:
+            result = S3XComBackend.CACHE.get(key)
+            if result is not _PayloadCache._MISSING:
+                S3XComBackend.METRICS.incr("cache.hits")
+                results[key] = result
+                continue
+            S3XComBackend.METRICS.incr("cache.misses")
+            missing.append(key)
+
+        # like load, one thread per object: disk tier, spill to a temporary
+        # file & multipart download of big ones, each payload is decoded as
+        # soon as it's downloaded
+        workers = min(S3XComBackend.MAX_CONCURRENCY, len(missing)) or 1
+        with ThreadPoolExecutor(workers) as executor:
+            futures = {
+                executor.submit(S3XComBackend._load_uncached, k): k
+                for k in missing
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+        keys = [S3XComBackend._key_of(v) for v in values]
+        return [results[k] if k else v for k, v in zip(keys, values)]
+
+    @staticmethod
+    def read_dataframe(
+        reference: Union[str, "LazyXComValue"],
+        columns: Optional[List[str]] = None,
+        filters: Optional[List[Any]] = None,
+        row_groups: Optional[List[int]] = None,
+    ) -> DaFe:
+        """reads only some columns / rows of a DataFrame stored in s3.
+
+        parquet objects are read with ranged GETs, only the footer and the
+        column chunks of the row groups that survive `filters` (pyarrow dnf
+        filters i.e. [("country", "=", "MX")]) are downloaded. Other formats
+        are loaded whole and the columns are selected afterwards."""
+        if isinstance(reference, LazyXComValue):
+            reference = reference.reference
+        key = reference.replace(S3XComBackend.VALUE_PREFIX, "")
+        if serializer_for_key(key) is not SERIALIZERS["parquet"]:
+            if filters or row_groups:
+                raise ValueError("filters & row_groups require parquet")
+            result: DaFe = S3XComBackend.load(key)
+            return result[columns] if columns else result
+
+        from pyarrow import parquet
+
+        reader = _S3RangeReader(
+            s3_client(), S3XComBackend.bucket_for(key), key
+        )
+        # coalesces the tiny reads pyarrow does while parsing the footer
+        with BufferedReader(reader, buffer_size=1024 * 1024) as file:
+            if row_groups is not None:
+                table = parquet.ParquetFile(file).read_row_groups(
+                    row_groups, columns=columns, use_pandas_metadata=True
+                )
+            else:
+                table = parquet.read_table(
+                    file,
+                    columns=columns,
+                    filters=filters,
+                    use_pandas_metadata=True,
+                )
+        return table.to_pandas()
+
+    @classmethod
+    def pull_dataframe(
+        cls,
+        ti,
+        task_id: str,
+        key: str = "return_value",
+        map_index: Optional[int] = None,
+        **kwargs,
+    ) -> Optional[DaFe]:
+        """ti.xcom_pull alternative which downloads only what it's needed,
+        kwargs are passed to read_dataframe i.e.
+
+        `S3XComBackend.pull_dataframe(ti, "extract", columns=["id", "total"])`
+        """
+        query = cls.get_many(
+            run_id=ti.run_id,
+            key=key,
+            task_ids=task_id,
+            dag_ids=ti.dag_id,
+            map_indexes=map_index,
+        )
+        row = query.first()
+        if row is None:
+            return None
+        # orm_deserialize_value keeps the reference, nothing downloaded yet
+        if not str(row.value).startswith(cls.VALUE_PREFIX):
+            raise ValueError(f"{task_id}/{key} is not stored in s3")
+        return cls.read_dataframe(row.value, **kwargs)
+
+    @classmethod
+    def pull_many(
+        cls, ti, task_ids: Union[str, List[str]], key: str = "return_value"
+    ) -> List[Any]:
+        """ti.xcom_pull(task_ids=[...]) alternative which downloads every
+        s3 payload concurrently, values are ordered by task_ids (then by
+        map_index), tasks without xcom are skipped"""
+        task_ids = [task_ids] if isinstance(task_ids, str) else task_ids
+        query = cls.get_many(
+            run_id=ti.run_id, key=key, task_ids=task_ids, dag_ids=ti.dag_id
+        )
+        rows = sorted(
+            query, key=lambda x: (task_ids.index(x.task_id), x.map_index)
+        )
+        # orm_deserialize_value keeps the references, nothing downloaded yet
+        return cls.load_many([row.value for row in rows])
+
     @staticmethod
     def deserialize_value(result) -> Any:
-        # result i.e "xcom_s3://xcom/data_78c30142-25b0-4b3b-bd71-70a777b5bba0"
+        # i.e "xcom_s3://xcom/3f/etl/manual__.../extract/-1/data_78c3..."
         result = BaseXCom.deserialize_value(result)
-        if isinstance(result, str) and result.startswith(S3XComBackend.VALUE_PREFIX):
+        if isinstance(result, str) and result.startswith(
+            S3XComBackend.VALUE_PREFIX
+        ):
+            if S3XComBackend.LAZY:
+                return LazyXComValue(result)
             key = result.replace(S3XComBackend.VALUE_PREFIX, "")
-            file = s3_hook().download_file(
-                key=key,
-                bucket_name=S3XComBackend.BUCKET_NAME,
-                local_path="/tmp",
-            )
-            if key.endswith(".parquet"):
-                result: DaFe = pd.read_parquet(file)
-            elif key.endswith(".json"):
-                result: dict = json.loads(file)
-            elif key.endswith(".csv"):
-                result: DaFe = pd.read_csv(file)
-            else:  # has s3 xcom backend prefix (was custom serialized)
-                raise ValueError("unknown file format")
+            result = S3XComBackend.load(key)
         return result
+
+    def orm_deserialize_value(self) -> Any:
+        """used by the webserver (i.e. xcom list view) and whenever the orm
+        builds an XCom row, it shows the s3 reference instead of the value
+        so nothing gets downloaded until a task deserializes it."""
+        return BaseXCom.deserialize_value(self)
+
+    @classmethod
+    def purge(cls, xcom, session=None) -> None:
+        """deletes the s3 object of an xcom row which is being removed,
+        objects under CAS_PREFIX may be shared by several rows so they're
+        left to reap_orphans"""
+        reference = xcom.value  # reference kept by orm_deserialize_value
+        if not isinstance(reference, str):
+            return
+        if not reference.startswith(cls.VALUE_PREFIX):
+            return
+        key = reference.replace(cls.VALUE_PREFIX, "")
+        if key.startswith(cls.CAS_PREFIX):
+            return
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        # it runs in the task process right before execute, a cleanup
+        # failure can't fail the task, reap_orphans deletes it later
+        try:
+            s3_client().delete_object(Bucket=cls.bucket_for(key), Key=key)
+        except (BotoCoreError, ClientError) as error:
+            log.warning("could not delete the xcom object %s: %s", key, error)
+
+    @classmethod
+    @provide_session
+    def clear(
+        cls,
+        execution_date=None,
+        dag_id: Optional[str] = None,
+        task_id: Optional[str] = None,
+        run_id: Optional[str] = None,
+        map_index: Optional[int] = None,
+        session=NEW_SESSION,
+        **kwargs,
+    ) -> None:
+        """airflow < 2.5 doesn't call purge by itself. Rows removed with
+        bulk deletes (airflow db clean, task retries) never reach this
+        method, reap_orphans takes care of those objects, so do the ones
+        cleared by execution_date instead of run_id (deprecated).
+
+        every mapped task instance clears its own map_index before running,
+        the objects of its siblings must be kept"""
+        if not hasattr(BaseXCom, "purge") and dag_id and task_id and run_id:
+            query = session.query(cls).filter(
+                cls.dag_id == dag_id,
+                cls.task_id == task_id,
+                cls.run_id == run_id,
+            )
+            if map_index is not None:
+                query = query.filter(cls.map_index == map_index)
+            for xcom in query:
+                cls.purge(xcom, session)
+        if map_index is not None:  # not a parameter of airflow < 2.3
+            kwargs["map_index"] = map_index
+        return super().clear(
+            execution_date=execution_date,
+            dag_id=dag_id,
+            task_id=task_id,
+            run_id=run_id,
+            session=session,
+            **kwargs,
+        )
+
+    @classmethod
+    @provide_session
+    def referenced_keys(cls, session=NEW_SESSION) -> Set[str]:
+        """s3 keys referenced by any row of the xcom table"""
+        from sqlalchemy import func
+
+        marker = json.dumps(cls.VALUE_PREFIX)[:-1].encode("UTF-8")
+        query = (  # references are short, skip big inline values
+            session.query(BaseXCom.value)
+            .filter(func.length(BaseXCom.value) < 2048)
+            .yield_per(1000)
+        )
+        return {
+            json.loads(value).replace(cls.VALUE_PREFIX, "")
+            for (value,) in query
+            if value and bytes(value).startswith(marker)
+        }
+
+    @classmethod
+    @provide_session
+    def reap_orphans(
+        cls,
+        dry_run: bool = True,
+        min_age: timedelta = timedelta(hours=24),
+        prefix: str = "xcom/",
+        bucket_name: Optional[str] = None,
+        session=NEW_SESSION,
+    ) -> List[str]:
+        """deletes s3 objects no xcom row references anymore, returns them.
+        bucket_name defaults to BUCKET_NAME, LEGACY_BUCKET_NAME reclaims
+        what was pushed before the xcom bucket existed.
+
+        objects younger than min_age are kept, their rows may not be
+        committed yet (the upload happens before the insert). Content
+        addressed objects older than CAS_REFRESH_SECONDS are refreshed when
+        pushed again, min_age must be longer than it."""
+        bucket_name = bucket_name or cls.BUCKET_NAME
+        referenced = cls.referenced_keys(session=session)
+        created_before = datetime.now(timezone.utc) - min_age
+        client = s3_client()
+        orphans = [
+            s3_object["Key"]
+            for page in client.get_paginator("list_objects_v2").paginate(
+                Bucket=bucket_name, Prefix=prefix
+            )
+            for s3_object in page.get("Contents", [])
+            if s3_object["Key"] not in referenced
+            and s3_object["LastModified"] < created_before
+        ]
+        log.info(
+            "%s orphan xcom objects found (%s referenced)%s",
+            len(orphans),
+            len(referenced),
+            ", dry run, nothing deleted" if dry_run else "",
+        )
+        if dry_run:
+            return orphans
+
+        cls._delete_keys(orphans, bucket_name)
+        return orphans
+
+    @classmethod
+    def _delete_keys(cls, keys: List[str], bucket_name: Optional[str] = None):
+        client = s3_client()
+        for start in range(0, len(keys), 1000):  # DeleteObjects limit
+            batch = keys[start : start + 1000]
+            response = client.delete_objects(
+                Bucket=bucket_name or cls.BUCKET_NAME,
+                Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True},
+            )
+            for error in response.get("Errors", []):
+                log.error("could not delete %s: %s", error["Key"], error)
+
+    @classmethod
+    def delete_run(cls, dag_id: str, run_id: str) -> List[str]:
+        """deletes every object pushed by a dag run (one prefix listing, no
+        metadata db involved), content addressed objects are shared between
+        runs so they're left to reap_orphans"""
+        prefix = cls.run_prefix(dag_id, run_id)
+        paginator = s3_client().get_paginator("list_objects_v2")
+        keys = [
+            s3_object["Key"]
+            for page in paginator.paginate(
+                Bucket=cls.BUCKET_NAME, Prefix=prefix
+            )
+            for s3_object in page.get("Contents", [])
+        ]
+        cls._delete_keys(keys)
+        return keys
+
+
+class LazyXComValue:
+    """stands in for a value stored in s3, it's downloaded the first time
+    it is used (attribute access, indexing, iteration, len, str...).
+
+    isinstance checks see the proxy, call .resolve() to obtain the real
+    value i.e. `df: DataFrame = ti.xcom_pull(task_ids="x").resolve()`."""
+
+    __slots__ = ("reference", "_value")
+
+    def __init__(self, reference: str):
+        self.reference = reference
+        self._value = _PayloadCache._MISSING
+
+    @property
+    def key(self) -> str:
+        return self.reference.replace(S3XComBackend.VALUE_PREFIX, "")
+
+    @property
+    def resolved(self) -> bool:
+        return self._value is not _PayloadCache._MISSING
+
+    def resolve(self) -> Any:
+        if self._value is _PayloadCache._MISSING:
+            self._value = S3XComBackend.load(self.key)
+        return self._value
+
+    def __getattr__(self, name):
+        # private & dunder lookups (copy, pickle, _value of an instance
+        # built without __init__) never download the payload
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __reduce__(self):
+        """copies & pickles are unresolved proxies of the same reference"""
+        return LazyXComValue, (self.reference,)
+
+    def __getitem__(self, item):
+        return self.resolve()[item]
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __contains__(self, item):
+        return item in self.resolve()
+
+    def __bool__(self):
+        return bool(self.resolve())
+
+    def __eq__(self, other):
+        return self.resolve() == other
+
+    def __str__(self):
+        return str(self.resolve())
+
+    def __repr__(self):
+        if not self.resolved:
+            return f"<LazyXComValue {self.reference}>"
+        return repr(self._value)
+
+
+if __name__ == "__main__":
+    # i.e. python s3_xcom_backend.py --delete --min-age-hours 48
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="deletes orphan s3 xcom objects")
+    parser.add_argument("--delete", action="store_true", help="not a dry run")
+    parser.add_argument("--min-age-hours", type=float, default=24)
+    parser.add_argument("--prefix", default="xcom/")
+    parser.add_argument("--bucket", help="defaults to the xcom bucket")
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    for orphan in S3XComBackend.reap_orphans(
+        dry_run=not arguments.delete,
+        min_age=timedelta(hours=arguments.min_age_hours),
+        prefix=arguments.prefix,
+        bucket_name=arguments.bucket,
+    ):
+        print(orphan)
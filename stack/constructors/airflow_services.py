@@ -14,6 +14,7 @@ from constructs import Construct
 
 from .core.config import (
     SCHEDULER_CONFIG,
+    SEPARATE_SCHEDULER_SERVICE,
     STAGE,
     WEB_SERVER_CONFIG,
     WORKER_CONFIG,
@@ -35,6 +36,7 @@ class AirflowConstruct(Construct):
         public_subnets: List[ec2.Subnet],
         capacity_providers: Dict[str, ecs.AsgCapacityProvider],
         s3_log_bucket: s3.Bucket,
+        s3_xcom_bucket_name: str,
         efs_volume_info: Optional[dict] = None,
         db_connection: str = "",
     ) -> None:
@@ -69,9 +71,9 @@ class AirflowConstruct(Construct):
             "AIRFLOW__WEBSERVER__RBAC": "True",
             "AIRFLOW__WEBSERVER__WARN_DEPLOYMENT_EXPOSURE": "False",
             "AIRFLOW__CORE__XCOM_BACKEND": "s3_xcom_backend.S3XComBackend",
-            "AIRFLOW__SCHEDULER__DAG_DIR_LIST_INTERVAL": (
-                "600" if STAGE == "prod" else "15"
-            ),
+            "XCOM_S3_BUCKET": s3_xcom_bucket_name,
+            # the webserver shows the code stored by the dag processor
+            "AIRFLOW__CORE__STORE_DAG_CODE": "True",
             # executor configs
             "AIRFLOW__CORE__EXECUTOR": "CeleryExecutor",
             "AIRFLOW__CELERY__RESULT_BACKEND": f"db+{db_connection}",
@@ -84,12 +86,46 @@ class AirflowConstruct(Construct):
             "AIRFLOW__LOGGING__REMOTE_BASE_LOG_FOLDER": (
                 f"s3://{s3_log_bucket.bucket_name}/logs"
             ),
-            # EFS configs
+        }
+        efs_environment = {
             "EFS_FULL_PATH": efs_volume_info["containerPath"],
             "EFS_GIT_REPO_FULL_PATH": efs_git_repo_full_path,
             "AIRFLOW__CODE_EDITOR__ROOT_DIRECTORY": efs_git_repo_full_path,
             "AIRFLOW_HOME": efs_git_repo_full_path,
         }
+        scheduler_environment = {
+            **environment_variables,
+            **efs_environment,
+            "AIRFLOW__SCHEDULER__DAG_DIR_LIST_INTERVAL": (
+                "600" if STAGE == "prod" else "15"
+            ),
+        }
+        worker_environment = {
+            **environment_variables,
+            **efs_environment,
+            # the auto scaling counts on it, keep them in sync
+            "AIRFLOW__CELERY__WORKER_CONCURRENCY": str(
+                WORKER_CONFIG["workerAutoScalingConfig"]["workerConcurrency"]
+            ),
+        }
+        if WEB_SERVER_CONFIG.get("serializedDagsOnly"):
+            web_server_environment = {
+                **environment_variables,
+                # the copy of this repo baked in the image (Dockerfile), its
+                # dags folder is never parsed, dags are read from the db
+                "AIRFLOW_HOME": "/opt/airflow",
+                "PYTHONPATH": "/opt/airflow",  # s3_xcom_backend
+                "AIRFLOW__CORE__MIN_SERIALIZED_DAG_FETCH_INTERVAL": str(
+                    WEB_SERVER_CONFIG["serializedDagFetchInterval"]
+                ),
+                # it edits the efs git repo, not mounted here
+                "AIRFLOW__CODE_EDITOR__ENABLED": "False",
+            }
+        else:
+            web_server_environment = {
+                **environment_variables,
+                **efs_environment,
+            }
         airflow_image_asset = DockerImageAsset(
             self, "AirflowBuildImage", directory="."
         )
@@ -100,13 +136,19 @@ class AirflowConstruct(Construct):
         worker_task = ecs.Ec2TaskDefinition(
             self, "WorkerTask", network_mode=ecs.NetworkMode.BRIDGE
         )
+        if SEPARATE_SCHEDULER_SERVICE:
+            scheduler_task = ecs.Ec2TaskDefinition(
+                self, "SchedulerTask", network_mode=ecs.NetworkMode.BRIDGE
+            )
+        else:  # combined mode, next to the webserver
+            scheduler_task = airflow_task
         mmap = (
-            (WEB_SERVER_CONFIG, airflow_task),
-            (SCHEDULER_CONFIG, airflow_task),
-            (WORKER_CONFIG, worker_task),
+            (WEB_SERVER_CONFIG, airflow_task, web_server_environment),
+            (SCHEDULER_CONFIG, scheduler_task, scheduler_environment),
+            (WORKER_CONFIG, worker_task, worker_environment),
         )
         self.populate_tasks_with_corresponding_containers(
-            airflow_image_asset, efs_volume_info, environment_variables, mmap
+            airflow_image_asset, efs_volume_info, mmap
         )
 
         # noinspection PyProtectedMember
@@ -122,6 +164,20 @@ class AirflowConstruct(Construct):
             config=WEB_SERVER_CONFIG,
         )._airflows_url
 
+        if SEPARATE_SCHEDULER_SERVICE:
+            ServiceConstruct(
+                self,
+                "SchedulerSvc",
+                cluster=cluster,
+                default_sg=default_sg,
+                vpc=vpc,
+                task_definition=scheduler_task,
+                role="scheduler",
+                subnets=private_subnets,  # non accessible from outside
+                asg_capacity_providers=[capacity_providers["scheduler"]],
+                config=SCHEDULER_CONFIG,
+            )
+
         ServiceConstruct(
             self,
             "WorkerSvc",
@@ -129,14 +185,14 @@ class AirflowConstruct(Construct):
             default_sg=default_sg,
             vpc=vpc,
             task_definition=worker_task,
-            is_worker_service=True,
+            role="worker",
             subnets=private_subnets,  # non accessible from outside
             asg_capacity_providers=[capacity_providers["worker"]],
             config=WORKER_CONFIG,
         )
 
     def populate_tasks_with_corresponding_containers(
-        self, airflow_image_asset, efs_volume_info, environment_variables, mmap
+        self, airflow_image_asset, efs_volume_info, mmap
     ):
         """
         Populate the tasks with the containers that are equivalent.
@@ -145,14 +201,15 @@ class AirflowConstruct(Construct):
             self: write your description
             airflow_image_asset: write your description
             efs_volume_info: write your description
-            environment_variables: write your description
-            mmap: write your description
+            mmap: (container config, task, environment variables) tuples
         """
-        for (container_info, task) in mmap:
+        for (container_info, task, environment_variables) in mmap:
             task: Union[ecs.Ec2TaskDefinition]
             container_info: dict
+            # i.e. the webserver in serialized dags only mode
+            mounts_efs = "EFS_FULL_PATH" in environment_variables
 
-            if efs_volume_info:
+            if efs_volume_info and mounts_efs:
                 task.add_volume(
                     name=efs_volume_info["volumeName"],
                     efs_volume_configuration=ecs.EfsVolumeConfiguration(
@@ -160,6 +217,19 @@ class AirflowConstruct(Construct):
                     ),
                 )
 
+            environment = environment_variables
+            xcom_cache = container_info.get("xcomCache")
+            if xcom_cache:  # shared by the containers of the same instance
+                task.add_volume(
+                    name="XComCache",
+                    host=ecs.Host(source_path=xcom_cache["hostPath"]),
+                )
+                environment = {
+                    **environment_variables,
+                    "XCOM_S3_CACHE_DIR": xcom_cache["containerPath"],
+                    "XCOM_S3_CACHE_DIR_MAX_BYTES": str(xcom_cache["maxBytes"]),
+                }
+
             container = task.add_container(
                 id=container_info["name"],
                 image=ecs.ContainerImage.from_docker_image_asset(
@@ -177,7 +247,7 @@ class AirflowConstruct(Construct):
                     ),
                 ),
                 entry_point=[container_info["entryPoint"]],
-                environment=environment_variables,
+                environment=environment,
                 cpu=container_info.get("cpu"),
                 memory_limit_mib=container_info.get("memoryLimitMiB"),
                 memory_reservation_mib=container_info.get(
@@ -187,7 +257,7 @@ class AirflowConstruct(Construct):
             container.add_port_mappings(
                 ecs.PortMapping(container_port=container_info["containerPort"])
             )
-            if efs_volume_info:
+            if efs_volume_info and mounts_efs:
                 task.task_role.add_managed_policy(
                     iam.ManagedPolicy.from_aws_managed_policy_name(
                         "AmazonElasticFileSystemClientReadWriteAccess"
@@ -200,6 +270,14 @@ class AirflowConstruct(Construct):
                         read_only=False,
                     )
                 )
+            if xcom_cache:
+                container.add_mount_points(
+                    ecs.MountPoint(
+                        container_path=xcom_cache["containerPath"],
+                        source_volume="XComCache",
+                        read_only=False,
+                    )
+                )
 
     @property
     def airflows_url(self):
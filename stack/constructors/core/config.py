@@ -43,6 +43,44 @@ LOCAL_DNS = f"airflows.{STAGE}.yokharian.local"  # none to obtain dns default
 # Set to None to generate a new one, with acm
 EXISTING_CERTIFICATE_ARN = None
 
+# node-local xcom cache (disk tier of s3_xcom_backend.py), a directory of
+# the worker instances bind-mounted in every worker container, xcoms pushed
+# or pulled by a task are read from it by the next tasks placed in the same
+# instance. Oldest files are evicted above "maxBytes", keep it well below
+# the ebs size. Set None to disable it.
+XCOM_CACHE_CONFIG = {
+    "hostPath": "/var/cache/airflow-xcom",
+    "containerPath": "/xcom-cache",
+    "maxBytes": 5 * 1024**3,
+}
+
+# web & scheduler run in the same ecs task (combined mode) unless this is
+# set, then the scheduler is a service of its own, in its own instances,
+# so parsing spikes don't starve the webserver and both scale alone.
+# Combined mode is cheaper, good enough for small stages.
+SEPARATE_SCHEDULER_SERVICE = STAGE == "prod"
+
+# ecs managed scaling sizes each asg for the tasks placed in it, with
+# "targetCapacityPercent" of its instances in use (100 = no spare one), so
+# tasks don't get stuck in PROVISIONING. Managed termination protection
+# (requires managed scaling) never scales in an instance running tasks,
+# i.e. a celery worker in the middle of a task; without it instances get
+# "taskDrainTime" minutes to drain (lifecycle hook) before terminating.
+# "warmPool" keeps "minSize" stopped & initialized instances, they join
+# the cluster in about a minute instead of booting from scratch.
+DEFAULT_CAPACITY_PROVIDER = {
+    "managedScaling": True,
+    "targetCapacityPercent": 100,
+    "managedTerminationProtection": True,
+    "taskDrainTime": 5,
+    "warmPool": None,  # i.e. {"minSize": 1}
+}
+
+# a stopped worker (scale in, deployment) gets SIGTERM, celery stops taking
+# tasks and waits for the running ones (warm shutdown), ecs kills it after
+# this, keep it longer than the execution_timeout of the dags
+WORKER_STOP_TIMEOUT = "35m"
+
 # web & scheduler are in one single container, the worker is in
 # a single container, this 'asg' configuration facilitates
 # deployments because while building one, when it's running
@@ -55,7 +93,9 @@ INSTANCE_TYPES = {  # just a mapping for the ASGs
         "arm": False,
         # (30 gb & STANDARD Type) ~ 0.2 USD per month 2022-07-01
         "ebs": [block_device(EbsDeviceVolumeType.STANDARD, 30)],
+        # desired_capacity is ignored with managed scaling
         "asg": {"max_capacity": 2, "min_capacity": 1, "desired_capacity": 1},
+        "capacityProvider": DEFAULT_CAPACITY_PROVIDER,
     },
     "worker": {
         "type": ec2.InstanceType.of(  # (2 VCpu & 4 GiB RAM) ~ $27.9744 month
@@ -64,12 +104,44 @@ INSTANCE_TYPES = {  # just a mapping for the ASGs
         "arm": False,
         # (30 gb & GP3 Type) ~ 2.4 USD per month 2022-07-03
         "ebs": [block_device(EbsDeviceVolumeType.GP3, 30)],
+        # desired_capacity is ignored with managed scaling
         "asg": {"max_capacity": 2, "min_capacity": 1, "desired_capacity": 1},
+        # scaling out on a growing queue shouldn't wait for a boot
+        "capacityProvider": {
+            **DEFAULT_CAPACITY_PROVIDER,
+            "warmPool": {"minSize": 1},
+        },
+        "userData": [
+            "echo ECS_CONTAINER_STOP_TIMEOUT="
+            f"{WORKER_STOP_TIMEOUT} >> /etc/ecs/ecs.config",
+        ]
+        # airflow runs as a non root user, docker would create it as root
+        + (
+            [
+                f"mkdir -p {XCOM_CACHE_CONFIG['hostPath']}",
+                f"chmod 1777 {XCOM_CACHE_CONFIG['hostPath']}",
+            ]
+            if XCOM_CACHE_CONFIG
+            else []
+        ),
     },
 }  # https://us-east-1.console.aws.amazon.com/ec2/v2/home#InstanceTypes
+if SEPARATE_SCHEDULER_SERVICE:
+    INSTANCE_TYPES["scheduler"] = {
+        "type": ec2.InstanceType.of(  # (2 VCpu & 4 GiB RAM) ~ $27.9744 month
+            ec2.InstanceClass.BURSTABLE3_AMD, ec2.InstanceSize.MEDIUM
+        ),
+        "arm": False,
+        # (30 gb & STANDARD Type) ~ 0.2 USD per month 2022-07-01
+        "ebs": [block_device(EbsDeviceVolumeType.STANDARD, 30)],
+        # desired_capacity is ignored with managed scaling
+        "asg": {"max_capacity": 2, "min_capacity": 1, "desired_capacity": 1},
+        "capacityProvider": DEFAULT_CAPACITY_PROVIDER,
+    }
 
 # If webserver is down after adding more DAGs, it is because loading all
-# DAGs requires > 2G memory, increase the memory of webserver instance.
+# DAGs requires > 2G memory, increase the memory of webserver instance
+# (or enable "serializedDagsOnly").
 WEB_SERVER_CONFIG = {  # 2048 memory is a GOOD value !
     "cpu": 1024,  # minimum is 512, but ec2 instance can handle it
     "memoryReservationMiB": _75_percent(2048),  # soft limit
@@ -80,6 +152,12 @@ WEB_SERVER_CONFIG = {  # 2048 memory is a GOOD value !
     "containerPort": 8080,
     "entryPoint": "/webserver_entry.sh",
     "logRetention": RetentionDays.ONE_MONTH,
+    # the webserver reads serialized dags from the db only, no efs mount nor
+    # AIRFLOW_HOME shared with the scheduler: its memory doesn't grow with
+    # the amount of dags. The code editor plugin is disabled in this mode.
+    "serializedDagsOnly": True,
+    # seconds, how often it refreshes a dag from the db (airflow default 10)
+    "serializedDagFetchInterval": 30,
 }
 SCHEDULER_CONFIG = {
     "cpu": WEB_SERVER_CONFIG["cpu"],
@@ -89,6 +167,9 @@ SCHEDULER_CONFIG = {
     "containerPort": 8081,
     "entryPoint": "/scheduler_entry.sh",
     "logRetention": RetentionDays.ONE_MONTH,
+    # only with SEPARATE_SCHEDULER_SERVICE, schedulers run active-active
+    # (HA & more throughput), postgres row level locking makes it safe
+    "desiredCount": 2 if STAGE == "prod" else 1,
 }
 WORKER_CONFIG = {  # 2048 is a good memory value, less may crash it
     "cpu": 2048,  # minimum is 1024, but ec2 instance can handle it
@@ -100,14 +181,38 @@ WORKER_CONFIG = {  # 2048 is a good memory value, less may crash it
     "containerPort": 8082,
     "entryPoint": "/worker_entry.sh",
     "logRetention": RetentionDays.ONE_MONTH,
+    "xcomCache": XCOM_CACHE_CONFIG,
     "workerAutoScalingConfig": {
         "minTaskCount": 1 if STAGE == "prod" else 1,
         "maxTaskCount": 2 if STAGE == "prod" else 2,
-        "cpuUsagePercent": 90,  # set None to ignore this one
-        "memUsagePercent": 85,  # set None to ignore this one
+        # io bound tasks barely use cpu/memory while the queue grows, the
+        # celery queue drives the scaling instead (see below)
+        "cpuUsagePercent": None,  # set None to ignore this one
+        "memUsagePercent": None,  # set None to ignore this one
+        # created by celery in sqs, [operators] default_queue of airflow.cfg
+        "sqsQueueName": "default",  # set None to ignore this one
+        # [celery] worker_concurrency, task slots of each worker task
+        "workerConcurrency": 16,
+        # (queued + running celery tasks) / (worker tasks * concurrency),
+        # 1 means every slot is busy, above it tasks are waiting in sqs.
+        # It only scales in when it's 0 (nothing queued nor running), down
+        # to the minimum, ecs can't choose the idle worker to stop
+        "backlogScaleOutAbove": 1.0,  # + 1 worker
+        "backlogScaleOutFastAbove": 2.0,  # + 2 workers
     },
 }
 
+# xcom payloads (s3_xcom_backend.py) have their own bucket, objects expire
+# after "expirationDays", they're intermediate data nobody re-reads later.
+# set "expressOneZoneAzId" to an availability zone ID (i.e. "use1-az4", not
+# a name like "us-east-1a") to use an S3 Express One Zone directory bucket
+# instead: single digit ms requests from that AZ, no multi AZ redundancy,
+# requires botocore >= 1.33 in the image.
+XCOM_BUCKET_CONFIG = {
+    "expirationDays": 7 if STAGE == "prod" else 2,
+    "expressOneZoneAzId": None,
+}
+
 RDS_DATABASE_CONFIG = {
     "dbName": f"{STAGE}AirFlows",
     "port": 5432,
@@ -83,6 +83,11 @@ class PolicyConstruct(Construct):
                 effect=iam.Effect.ALLOW,
                 resources=["*"],
             ),
+            iam.PolicyStatement(  # S3 Express One Zone xcom bucket
+                actions=["s3express:CreateSession"],
+                effect=iam.Effect.ALLOW,
+                resources=["*"],
+            ),
             iam.PolicyStatement(
                 actions=[
                     # READ ONLY
@@ -13,7 +13,7 @@ from constructs import Construct
 from .airflow_services import AirflowConstruct
 from .efs import EFSConstruct
 from .rds import RDSConstruct
-from .core.config import INSTANCE_TYPES, STAGE
+from .core.config import INSTANCE_TYPES, STAGE, XCOM_BUCKET_CONFIG
 
 
 class ApacheAirflowsMainConstruct(Construct):
@@ -23,6 +23,7 @@ class ApacheAirflowsMainConstruct(Construct):
     _efs_arn: str
     _datasync_task_name: str
     _s3_bucket_name: str
+    _s3_xcom_bucket_name: str
     _main_efs: EFSConstruct
 
     def __init__(
@@ -60,6 +61,8 @@ class ApacheAirflowsMainConstruct(Construct):
             cluster_name=f"airflows-{STAGE}",
             vpc=vpc,
             enable_fargate_capacity_providers=True,
+            # RunningTaskCount, used by the worker auto scaling
+            container_insights=True,
         )
         capacity_provider = dict(
             self.set_up_capacity_provider_config(
@@ -79,6 +82,8 @@ class ApacheAirflowsMainConstruct(Construct):
 
         # create a bucket to save logs
         s3_log_bucket = self.build_s3_log_bucket()
+        # and another one for xcom payloads
+        s3_xcom_bucket_name = self.build_s3_xcom_bucket()
 
         # Create Airflow service: Webserver, Scheduler and minimal Worker
         airflow_construct = AirflowConstruct(
@@ -93,6 +98,7 @@ class ApacheAirflowsMainConstruct(Construct):
             efs_volume_info=self.main_efs.efs_volume_info,
             capacity_providers=capacity_provider,
             s3_log_bucket=s3_log_bucket,
+            s3_xcom_bucket_name=s3_xcom_bucket_name,
         )
 
         self._efs_id = self.main_efs.efs_id
@@ -102,6 +108,7 @@ class ApacheAirflowsMainConstruct(Construct):
         self._airflows_url = airflow_construct.airflows_url
         self._web_admin_password = airflow_construct.admin_password
         self._s3_log_bucket_name = s3_log_bucket.bucket_name
+        self._s3_xcom_bucket_name = s3_xcom_bucket_name
 
     # noinspection PyTypeChecker,PydanticTypeChecker
     def build_s3_log_bucket(self) -> s3.Bucket:
@@ -126,6 +133,63 @@ class ApacheAirflowsMainConstruct(Construct):
             removal_policy=cdk.RemovalPolicy.RETAIN,
         )
 
+    def build_s3_xcom_bucket(self, config: dict = XCOM_BUCKET_CONFIG) -> str:
+        """builds the xcom bucket, returns its name. There's no L2 construct
+        for S3 Express directory buckets, a raw CfnResource is used.
+
+        the expiration covers xcom/cas/ too, content addressed objects are
+        copied onto themselves when they're pushed again and are older
+        than XCOM_S3_CAS_REFRESH_SECONDS (hours, the expiration is days),
+        so they expire counting from about the newest row referencing
+        them, like the per run objects"""
+        expiration_days = config["expirationDays"]
+        abort_multipart_after = cdk.Duration.days(1)  # failed uploads
+        az_id = config.get("expressOneZoneAzId")
+        if az_id:
+            bucket = cdk.CfnResource(
+                self,
+                "s3XComDirectoryBucket",
+                type="AWS::S3Express::DirectoryBucket",
+                properties={
+                    # the name must end with --<az id>--x-s3
+                    "BucketName": f"{STAGE}-airflows-xcom--{az_id}--x-s3",
+                    "DataRedundancy": "SingleAvailabilityZone",
+                    "LocationName": az_id,
+                    "LifecycleConfiguration": {
+                        "Rules": [
+                            {
+                                "Id": "ExpireXComs",
+                                "Status": "Enabled",
+                                "ExpirationInDays": expiration_days,
+                                "AbortIncompleteMultipartUpload": {
+                                    "DaysAfterInitiation": (
+                                        abort_multipart_after.to_days()
+                                    )
+                                },
+                            }
+                        ]
+                    },
+                },
+            )
+            bucket.apply_removal_policy(cdk.RemovalPolicy.DESTROY)
+            return bucket.ref  # the bucket name
+
+        return s3.Bucket(
+            self,
+            "s3XComBucket",
+            bucket_name=f"{STAGE}-airflows-xcom-bucket",
+            versioned=False,
+            lifecycle_rules=[
+                s3.LifecycleRule(
+                    expiration=cdk.Duration.days(expiration_days),
+                    abort_incomplete_multipart_upload_after=(
+                        abort_multipart_after
+                    ),
+                )
+            ],
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+        ).bucket_name
+
     def set_up_capacity_provider_config(
         self, cluster, private_subnets, public_subnets, sg, vpc
     ):
@@ -142,13 +206,21 @@ class ApacheAirflowsMainConstruct(Construct):
         """
         for name, configs in INSTANCE_TYPES.items():
             subnets = public_subnets if name == "default" else private_subnets
+            provider = configs["capacityProvider"]
+            # managed scaling owns the size, a fixed desired capacity would
+            # reset it on every deployment
+            desired_capacity = (
+                None
+                if provider["managedScaling"]
+                else configs["asg"]["desired_capacity"]
+            )
 
             asg = autoscaling.AutoScalingGroup(
                 self,
                 f"{name}AutoScalingGroup",
                 max_capacity=configs["asg"]["max_capacity"],
                 min_capacity=configs["asg"]["min_capacity"],
-                desired_capacity=configs["asg"]["desired_capacity"],
+                desired_capacity=desired_capacity,
                 vpc=vpc,
                 instance_monitoring=autoscaling.Monitoring.BASIC,
                 vpc_subnets={"subnets": subnets},
@@ -162,11 +234,38 @@ class ApacheAirflowsMainConstruct(Construct):
                 associate_public_ip_address=True,  # needed for deploy (BUG)
                 block_devices=configs["ebs"],
                 update_policy=UpdatePolicy.rolling_update(),
+                new_instances_protected_from_scale_in=provider[
+                    "managedTerminationProtection"
+                ],
             )
+            for command in configs.get("userData", []):
+                asg.add_user_data(command)
+            if provider.get("warmPool"):
+                asg.add_warm_pool(
+                    min_size=provider["warmPool"]["minSize"],
+                    pool_state=autoscaling.PoolState.STOPPED,
+                )
+                # the ecs agent registers the instance once it leaves the
+                # pool, not while it's being initialized
+                asg.add_user_data(
+                    "echo ECS_WARM_POOLS_CHECK=true >> /etc/ecs/ecs.config"
+                )
             asg_capacity_provider = ecs.AsgCapacityProvider(
-                self, f"{name}AsgCapacityProvider", auto_scaling_group=asg
+                self,
+                f"{name}AsgCapacityProvider",
+                auto_scaling_group=asg,
+                enable_managed_scaling=provider["managedScaling"],
+                target_capacity_percent=provider["targetCapacityPercent"],
+                enable_managed_termination_protection=provider[
+                    "managedTerminationProtection"
+                ],
+            )
+            # the draining hook is skipped by cdk with managed termination
+            # protection, ecs already waits for the tasks of the instance
+            drain_time = cdk.Duration.minutes(provider["taskDrainTime"])
+            cluster.add_asg_capacity_provider(
+                asg_capacity_provider, task_drain_time=drain_time
             )
-            cluster.add_asg_capacity_provider(asg_capacity_provider)
             yield name, asg_capacity_provider
 
     @property
@@ -200,3 +299,7 @@ class ApacheAirflowsMainConstruct(Construct):
     @property
     def s3_log_bucket_name(self):
         return self._s3_log_bucket_name
+
+    @property
+    def s3_xcom_bucket_name(self):
+        return self._s3_xcom_bucket_name
@@ -1,8 +1,10 @@
-from typing import List, Optional, Union
+from typing import List, Union
 
 import aws_cdk as cdk
 from aws_cdk import (
+    aws_applicationautoscaling as appscaling,
     aws_certificatemanager as certificatemanager,
+    aws_cloudwatch as cloudwatch,
     aws_ec2 as ec2,
     aws_ecs as ecs,
     aws_elasticloadbalancingv2 as elbv2,
@@ -37,7 +39,7 @@ class ServiceConstruct(Construct):
         subnets: ec2.Subnet,
         asg_capacity_providers: List[ecs.AsgCapacityProvider],
         config: dict,
-        is_worker_service: Optional[bool] = False,
+        role: str = "web",
     ) -> None:
         """
         Create a new Airflow service.
@@ -49,6 +51,8 @@ class ServiceConstruct(Construct):
             cluster: write your description
             default_sg: write your description
             task_definition: write your description
+            role: "web" (behind the load balancer, the scheduler may run in
+                the same task), "scheduler" or "worker"
         """
         super().__init__(parent, name)
 
@@ -60,14 +64,14 @@ class ServiceConstruct(Construct):
             task_definition.task_role.add_to_principal_policy(policy)
 
         # Create ec2 Service for Airflow
-        service_name = (
-            f"{STAGE}-{'worker' if is_worker_service else 'web'}-airflows"
-        )
+        service_name = f"{STAGE}-{role}-airflows"
         self.ecs_service = ecs.Ec2Service(
             self,
             name,
             cluster=cluster,
             task_definition=task_definition,
+            # unset keeps the running count on updates (autoscaled workers)
+            desired_count=config.get("desiredCount"),
             enable_execute_command=True,
             service_name=service_name,
             capacity_provider_strategies=[
@@ -83,10 +87,9 @@ class ServiceConstruct(Construct):
             # vpc_subnets={"subnets": subnets},
             # assign_public_ip=False,  # needed for deploy (BUG)
         )
-        if is_worker_service:
-            ...
-            # self.configure_worker_auto_scaling()
-        else:
+        if role == "worker":
+            self.configure_worker_auto_scaling()
+        elif role == "web":
             # Export Load Balancer DNS Name
             # which will be used to access Airflow UI
             self.attach_application_load_balancer(
@@ -272,3 +275,67 @@ class ServiceConstruct(Construct):
                 scale_in_cooldown=cdk.Duration.seconds(60),
                 scale_out_cooldown=cdk.Duration.seconds(60),
             )
+        if config.get("sqsQueueName"):
+            # ec2 capacity follows through the managed scaling of the
+            # worker AsgCapacityProvider
+            scaling.scale_on_metric(
+                "SqsBacklogPerWorkerScaling",
+                metric=self.backlog_per_worker_metric(config),
+                adjustment_type=appscaling.AdjustmentType.CHANGE_IN_CAPACITY,
+                scaling_steps=[
+                    # idle, nothing queued nor running, down to the minimum
+                    appscaling.ScalingInterval(
+                        upper=0, change=-config["maxTaskCount"]
+                    ),
+                    appscaling.ScalingInterval(
+                        lower=config["backlogScaleOutAbove"],
+                        upper=config["backlogScaleOutFastAbove"],
+                        change=+1,
+                    ),
+                    appscaling.ScalingInterval(
+                        lower=config["backlogScaleOutFastAbove"], change=+2
+                    ),
+                ],
+                cooldown=cdk.Duration.seconds(120),
+            )
+
+    def backlog_per_worker_metric(
+        self, config: dict
+    ) -> cloudwatch.MathExpression:
+        """(queued + running celery tasks) / (worker tasks * concurrency),
+        sqs messages stay not visible while a task runs (acks late)"""
+        period = cdk.Duration.minutes(1)
+        queue = {"QueueName": config["sqsQueueName"]}
+        slots = config["workerConcurrency"]
+        return cloudwatch.MathExpression(
+            expression="(visible + running) / "
+            f"(IF(workers > 0, workers, 1) * {slots})",
+            using_metrics={
+                "visible": cloudwatch.Metric(
+                    namespace="AWS/SQS",
+                    metric_name="ApproximateNumberOfMessagesVisible",
+                    dimensions_map=queue,
+                    statistic="Maximum",
+                    period=period,
+                ),
+                "running": cloudwatch.Metric(
+                    namespace="AWS/SQS",
+                    metric_name="ApproximateNumberOfMessagesNotVisible",
+                    dimensions_map=queue,
+                    statistic="Maximum",
+                    period=period,
+                ),
+                "workers": cloudwatch.Metric(  # needs container insights
+                    namespace="ECS/ContainerInsights",
+                    metric_name="RunningTaskCount",
+                    dimensions_map={
+                        "ClusterName": self.ecs_service.cluster.cluster_name,
+                        "ServiceName": self.ecs_service.service_name,
+                    },
+                    statistic="Average",
+                    period=period,
+                ),
+            },
+            label="SQS backlog per worker",
+            period=period,
+        )
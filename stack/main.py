@@ -96,6 +96,7 @@ class AirflowsMainStack(Stack):
             "datasyncTaskName": airflows_construct.datasync_task_name,
             "S3EfsBucketName": airflows_construct.s3_bucket_name,
             "S3LogsBucketName": airflows_construct.s3_log_bucket_name,
+            "S3XComBucketName": airflows_construct.s3_xcom_bucket_name,
         }.items():
             if not value:
                 continue  # will raise exception on cloudformation if empty
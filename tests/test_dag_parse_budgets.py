@@ -0,0 +1,36 @@
+"""every dag file of the yokharian package parses within its budget of
+dag_parse_budgets.json (no metadata db queries), measured the same way
+dag_parse_profiler.py does, each file in its own process"""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("airflow")
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import dag_parse_profiler as profiler  # noqa: E402
+
+DAGS_FOLDER = ROOT / "dags"
+BUDGETS = json.loads(profiler.DEFAULT_BUDGETS.read_text())
+DAG_FILES = [
+    path
+    for path in profiler.list_dag_files(DAGS_FOLDER)
+    if path.relative_to(DAGS_FOLDER).parts[0] == "yokharian"
+]
+
+
+def test_yokharian_has_a_budget():
+    assert profiler.budget_for("yokharian/send_email/email_dag.py", BUDGETS)
+    assert DAG_FILES
+
+
+@pytest.mark.parametrize(
+    "path", DAG_FILES, ids=lambda x: str(x.relative_to(DAGS_FOLDER))
+)
+def test_dag_file_parses_within_budget(path):
+    row = profiler.profile(path, DAGS_FOLDER, timeout=60, top=5)
+    assert profiler.over_budget(row, BUDGETS) == [], row